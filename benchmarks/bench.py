@@ -0,0 +1,259 @@
+"""
+Benchmarks for the hot paths of the CLI.
+
+Run with ``invoke bench``, or ``python benchmarks/bench.py``. The results
+are written to results.json, and compared with baseline.json to flag
+regressions. Timings depend on the machine, so the baseline is not part of
+the repo: create one with ``--save`` (e.g. on the main branch) before
+comparing with it.
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import argparse
+import datetime
+import platform
+import statistics
+import tempfile
+import subprocess
+from contextlib import redirect_stdout
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, "tests"))
+
+from timetagger_cli import core, config, utils, jsonstream  # noqa: E402
+from timetagger_cli.records import RecordBatch  # noqa: E402
+from timetagger_cli.shell_completion import command_names  # noqa: E402
+from timetagger_cli.__main__ import main  # noqa: E402
+from _fake_server import FakeServer, generate_records  # noqa: E402
+
+RESULTS_FILENAME = os.path.join(BENCH_DIR, "results.json")
+BASELINE_FILENAME = os.path.join(BENCH_DIR, "baseline.json")
+
+# Results that are this much slower than the baseline are flagged
+REGRESSION_RATIO = 1.25
+
+benchmarks = []
+
+
+def benchmark(func):
+    benchmarks.append(func)
+    return func
+
+
+def measure(func, repeat=5):
+    """Get the median time (in seconds) of calling func."""
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times)
+
+
+def quiet(func, *args):
+    """Call func with its output discarded."""
+    with redirect_stdout(io.StringIO()):
+        func(*args)
+
+
+def sizes(quick):
+    return [1_000, 100_000] if quick else [1_000, 100_000, 1_000_000]
+
+
+@benchmark
+def bench_cold_start(quick):
+    """Start a new process for each subcommand (only parsing its arguments)."""
+    results = {}
+    for name in ["--version"] + [f"{name} --help" for name in command_names]:
+        cmd = [sys.executable, "-m", "timetagger_cli", *name.split()]
+        run = lambda: subprocess.run(cmd, stdout=subprocess.DEVNULL, check=True)
+        results[f"cold_start[{name.split()[0]}]"] = measure(run, 3 if quick else 7)
+    return results
+
+
+@benchmark
+def bench_print_records(quick):
+    results = {}
+    for n in sizes(quick):
+        records = generate_records(n)
+        run = lambda: quiet(core.print_records, records)
+        results[f"print_records[{n}]"] = measure(run, 1 if n > 100_000 else 3)
+        batch = RecordBatch(records)
+        run = lambda: quiet(core.print_records, batch)
+        results[f"print_batch[{n}]"] = measure(run, 1 if n > 100_000 else 3)
+    return results
+
+
+@benchmark
+def bench_total_time(quick):
+    results = {}
+    for n in sizes(quick):
+        records = generate_records(n)
+        t1 = datetime.datetime.fromtimestamp(records[0]["t1"] + 3600)
+        t2 = datetime.datetime.fromtimestamp(records[-1]["t2"] - 3600)
+        run = lambda: utils.total_time(records, t1, t2)
+        results[f"total_time[{n}]"] = measure(run)
+    return results
+
+
+@benchmark
+def bench_filter_records(quick):
+    """Selecting the records of a day, as dicts and as a RecordBatch."""
+    results = {}
+    for n in sizes(quick):
+        records = generate_records(n)
+        batch = RecordBatch(records)
+        t1 = records[n // 2]["t1"]
+        t2 = t1 + 86400
+
+        def filter_dicts():
+            records2 = [r for r in records if not r["ds"].startswith("HIDDEN")]
+            return [r for r in records2 if r["t1"] < t2 and r["t2"] > t1]
+
+        results[f"filter_dicts[{n}]"] = measure(filter_dicts)
+        results[f"filter_batch[{n}]"] = measure(
+            lambda: batch.visible().overlapping(t1, t2)
+        )
+    return results
+
+
+@benchmark
+def bench_json_decode(quick):
+    results = {}
+    for n in sizes(quick)[:2]:
+        data = json.dumps({"records": generate_records(n)}).encode()
+        results[f"json_decode[{n}]"] = measure(lambda: json.loads(data))
+        chunks = [data[i : i + 2**16] for i in range(0, len(data), 2**16)]
+        results[f"json_stream[{n}]"] = measure(
+            lambda: sum(1 for r in jsonstream.iter_array(chunks, "records"))
+        )
+    return results
+
+
+@benchmark
+def bench_diagnose(quick):
+    """The classification of records, without fetching them."""
+    results = {}
+    iter_all_records = core.iter_all_records
+    try:
+        for n in sizes(quick)[:2]:
+            records = generate_records(n)
+            core.iter_all_records = lambda: iter(records)
+            args = argparse.Namespace(
+                fix=False, incremental=False, overlaps=False, fix_duplicates=False
+            )
+            results[f"diagnose[{n}]"] = measure(lambda: quiet(core.diagnose, args))
+    finally:
+        core.iter_all_records = iter_all_records
+    return results
+
+
+@benchmark
+def bench_commands(quick):
+    """End-to-end commands against a local fake server, with some latency."""
+    now = time.time()
+    n = 10_000 if quick else 100_000
+    # Records up to now, so that the commands have data to show
+    t_start = now - n * 3900
+    records = generate_records(n, t_start)
+    records = [r for r in records if r["t2"] < now]
+
+    results = {}
+    load_config = core.load_config
+    # Use a temporary config dir, so that the user's journal is not pushed,
+    # and commands are not forwarded to a daemon.
+    config_dir = config._config_dir
+    config._config_dir = tempfile.mkdtemp()
+    with FakeServer(records, latency=0.005) as server:
+        core.load_config = lambda: config.default_config | server.config()
+        try:
+            for argv in [
+                ["status"],
+                ["show", "--days", "30"],
+                ["report", "--days", "365", "--period", "month"],
+                ["export", "--days", "365", "--output", os.devnull],
+                ["diagnose"],
+            ]:
+
+                def run():
+                    core._deadline = None  # the deadline is per command
+                    quiet(main, argv)
+
+                results[f"command[{argv[0]}]"] = measure(run, 3)
+        finally:
+            core.load_config = load_config
+            shutil.rmtree(config._config_dir, ignore_errors=True)
+            config._config_dir = config_dir
+    return results
+
+
+def run_benchmarks(quick=False, filter=None):
+    results = {}
+    for func in benchmarks:
+        if filter and filter not in func.__name__:
+            continue
+        print(f"Running {func.__name__} ...")
+        results.update(func(quick))
+    return results
+
+
+def compare(results, baseline):
+    """Print the results next to the baseline. Returns the regressed names."""
+    regressions = []
+    print(f"\n{'Benchmark':<28} {'Time':>10} {'Baseline':>10}  Ratio")
+    for name, t in results.items():
+        t_base = baseline.get(name)
+        if t_base:
+            ratio = t / t_base
+            flag = "  REGRESSION" if ratio > REGRESSION_RATIO else ""
+            if flag:
+                regressions.append(name)
+            print(
+                f"{name:<28} {t*1000:>8.2f}ms {t_base*1000:>8.2f}ms  {ratio:.2f}{flag}"
+            )
+        else:
+            print(f"{name:<28} {t*1000:>8.2f}ms {'-':>10}")
+    return regressions
+
+
+def main_bench(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--quick", action="store_true", help="skip the largest sizes")
+    parser.add_argument("--save", action="store_true", help="store as the baseline")
+    parser.add_argument("--filter", help="only run benchmarks matching this name")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.quick, args.filter)
+    meta = {
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+    }
+    with open(RESULTS_FILENAME, "wb") as f:
+        f.write(json.dumps({"meta": meta, "results": results}, indent=2).encode())
+
+    baseline = {}
+    if os.path.isfile(BASELINE_FILENAME):
+        with open(BASELINE_FILENAME, "rb") as f:
+            baseline = json.loads(f.read().decode())["results"]
+    regressions = compare(results, baseline)
+
+    if not baseline and not args.save:
+        print("\nNo baseline to compare with, create one with --save")
+    if args.save:
+        with open(BASELINE_FILENAME, "wb") as f:
+            f.write(json.dumps({"meta": meta, "results": results}, indent=2).encode())
+        print(f"\nSaved the baseline to {BASELINE_FILENAME}")
+    elif regressions:
+        sys.exit(f"\n{len(regressions)} benchmarks are slower than the baseline")
+
+
+if __name__ == "__main__":
+    main_bench()
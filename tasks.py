@@ -37,6 +37,16 @@ def tests(ctx, cover=False):
         webbrowser.open(os.path.join(ROOT_DIR, "htmlcov", "index.html"))
 
 
+@task
+def bench(ctx, quick=False, save=False, filter=""):
+    """Run the benchmarks and compare with the baseline. Use --save to create/update the (local) baseline."""
+    cmd = [sys.executable, os.path.join(ROOT_DIR, "benchmarks", "bench.py")]
+    cmd += ["--quick"] * quick + ["--save"] * save + ["--filter", filter] * bool(filter)
+    ret_code = subprocess.call(cmd, cwd=ROOT_DIR)
+    if ret_code:
+        sys.exit(ret_code)
+
+
 @task
 def lint(ctx):
     """Validate the code style (e.g. undefined names)"""
@@ -1,3 +1,26 @@
+import shutil
+import tempfile
+import contextlib
+
+from timetagger_cli import config
+
+
+@contextlib.contextmanager
+def temp_config_dir():
+    """Context manager to use a temporary config dir (with a config file),
+    so that a test does not touch the user's config, journal, caches etc.
+    Yields the path of the directory.
+    """
+    config_dir = config._config_dir
+    config._config_dir = tempfile.mkdtemp()
+    try:
+        config.prepare_config_file()
+        yield config._config_dir
+    finally:
+        shutil.rmtree(config._config_dir, ignore_errors=True)
+        config._config_dir = config_dir
+
+
 def run_tests(scope):
     """Run all test functions in the given scope."""
     for func in list(scope.values()):
@@ -0,0 +1,186 @@
+"""
+A lightweight stand-in for the TimeTagger API, running in a thread of the
+current process. It implements the endpoints used by the CLI, so that the
+client can be tested and benchmarked end-to-end without network access.
+"""
+
+import json
+import time
+import random
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+def generate_records(n, t_start=1_600_000_000, seed=0):
+    """Generate n synthetic records, back to back from the given start time."""
+    rng = random.Random(seed)
+    tags = ["#work", "#meeting", "#code", "#admin", "#client1", "#client2"]
+    records = []
+    t = t_start
+    for i in range(n):
+        t1 = t + rng.randint(0, 600)
+        t2 = t1 + rng.randint(60, 7200)
+        ds = " ".join(rng.sample(tags, rng.randint(0, 2))) + f" task {i}"
+        records.append(dict(key=f"r{i:07d}", t1=t1, t2=t2, mt=t2, st=0, ds=ds))
+        t = t2
+    return records
+
+
+class FakeServer:
+    """An in-process fake TimeTagger server.
+
+    Supports ``GET records?timerange=t1-t2``, ``GET updates?since=st`` and
+    ``PUT records``. Use ``latency`` to simulate a slow server, and
+    ``fail_next()`` to make the next requests fail. Use it as a context
+    manager to start and stop it.
+    """
+
+    def __init__(self, records=(), latency=0, token="test"):
+        self.latency = latency
+        self.token = token
+        self.records = {}
+        self.requests = []  # (method, path, status, bytes) tuples
+        self._failures = []
+        self._lock = threading.Lock()
+        self._httpd = None
+        self.put_records(records)
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/api/v2/"
+
+    def config(self, **options):
+        """Get a config dict (without defaults) to let the client use this server."""
+        return {"api_url": self.url, "api_token": self.token, **options}
+
+    def start(self):
+        server = self
+
+        class Handler(RequestHandler):
+            fake = server
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._httpd.daemon_threads = True
+        serve = lambda: self._httpd.serve_forever(poll_interval=0.01)
+        threading.Thread(target=serve, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def fail_next(self, *status_codes, retry_after=None):
+        """Let the next requests fail with the given status codes."""
+        with self._lock:
+            self._failures += [(code, retry_after) for code in status_codes]
+
+    def put_records(self, records):
+        """Add or update records, like a client would. Returns the
+        accepted keys, failed keys, and errors.
+        """
+        accepted, failed, errors = [], [], []
+        with self._lock:
+            st = time.time()
+            for r in records:
+                error = validate_record(r)
+                if error:
+                    failed.append(r.get("key", ""))
+                    errors.append(error)
+                else:
+                    self.records[r["key"]] = dict(r, st=st)
+                    accepted.append(r["key"])
+        return accepted, failed, errors
+
+    # Endpoints
+
+    def handle(self, method, path, body):
+        """Handle a request and get the status code, JSON object and headers."""
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            failure = self._failures.pop(0) if self._failures else None
+        if failure:
+            code, retry_after = failure
+            headers = {} if retry_after is None else {"Retry-After": str(retry_after)}
+            return code, {"error": f"injected error {code}"}, headers
+
+        url = urlsplit(path)
+        query = parse_qs(url.query)
+        endpoint = url.path.split("/api/v2/", 1)[-1]
+        if method == "GET" and endpoint == "records" and "timerange" in query:
+            t1, t2 = map(float, query["timerange"][0].split("-"))
+            return 200, {"records": self.get_records(t1, t2)}, {}
+        elif method == "GET" and endpoint == "updates" and "since" in query:
+            since = float(query["since"][0])
+            with self._lock:
+                records = [r for r in self.records.values() if r["st"] > since]
+            ob = {"server_time": time.time(), "reset": since == 0, "records": records}
+            return 200, ob, {}
+        elif method == "PUT" and endpoint == "records":
+            if not isinstance(body, list):
+                return 400, {"error": "Expected a list of records"}, {}
+            accepted, failed, errors = self.put_records(body)
+            return 200, {"accepted": accepted, "failed": failed, "errors": errors}, {}
+        return 404, {"error": f"No endpoint {method} {endpoint}"}, {}
+
+    def get_records(self, t1, t2):
+        with self._lock:
+            return [
+                r
+                for r in self.records.values()
+                if (r["t2"] >= t1 and r["t1"] <= t2) or (r["t1"] == r["t2"] <= t2)
+            ]
+
+
+def validate_record(r):
+    """Get an error message if the record is invalid, like the server does."""
+    if not isinstance(r, dict):
+        return "Record must be a dict"
+    for name in ("key", "t1", "t2", "mt", "ds"):
+        if name not in r:
+            return f"Record is missing {name}"
+    if r["t1"] > r["t2"]:
+        return "Record t1 is larger than t2"
+    return None
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep connections alive, like a real server
+    fake = None  # set in subclass
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def _handle(self, method):
+        size = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(size).decode()) if size else None
+        if self.headers.get("authtoken") != self.fake.token:
+            status, ob, headers = 401, {"error": "Invalid auth token"}, {}
+        else:
+            status, ob, headers = self.fake.handle(method, self.path, body)
+        data = json.dumps(ob).encode()
+        self.fake.requests.append((method, self.path, status, len(data)))
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass  # keep the test output clean
@@ -1,11 +1,14 @@
+import os
 import sys
 import io
+import datetime
+import subprocess
 from contextlib import redirect_stdout
 
 import timetagger_cli
-from timetagger_cli import __main__
+from timetagger_cli import __main__, journal
 from pytest import raises
-from _common import run_tests
+from _common import run_tests, temp_config_dir
 
 
 def _raise_RuntimeError():
@@ -24,40 +27,101 @@ def run_main(argv=None):
 
 
 def test_cli():
-    # Empty args is help
-    text = run_main([])
-    for x in ["timetagger", "CLI", "version", "setup", "status", "start", "stop"]:
-        assert x in text
-
-    # Other common ways to get help
-    for arg in ["-h", "--help"]:
-        text_help = run_main([arg])
-        assert text_help == text
-
-    # No args uses sys.argv
-    sys.argv = ["", "--version"]
-    text_version = run_main()
-    assert timetagger_cli.__version__ in text_version
-
-    # Invalid command
-    with raises(SystemExit) as excinfo:
-        run_main(["notavalidcommand"])
-    assert excinfo.value.code == 2
-
-    # Error in command
-    timetagger_cli.core.request = lambda method, path, body=None: _raise_RuntimeError()
-    with raises(SystemExit):
+    with temp_config_dir():
+        # Empty args is help
+        text = run_main([])
+        for x in ["timetagger", "CLI", "version", "setup", "status", "start", "stop"]:
+            assert x in text
+
+        # Other common ways to get help
+        for arg in ["-h", "--help"]:
+            text_help = run_main([arg])
+            assert text_help == text
+
+        # No args uses sys.argv
+        sys.argv = ["", "--version"]
+        text_version = run_main()
+        assert timetagger_cli.__version__ in text_version
+
+        # Invalid command
+        with raises(SystemExit) as excinfo:
+            run_main(["notavalidcommand"])
+        assert excinfo.value.code == 2
+
+        # Error in command
+        timetagger_cli.core.request = (
+            lambda method, path, body=None, **kwargs: _raise_RuntimeError()
+        )
+        with raises(SystemExit):
+            run_main(["status"])
+
+        # Other errors fall through
+        with raises(SystemExit):
+            run_main(["status", "status_func_has_no_args"])
+        assert excinfo.value.code == 2
+
+        # Queued records are not pushed before commands whose output is
+        # consumed by other programs
+        journal.append_records([dict(key="q", t1=1, t2=2, mt=1, ds="")])
+        text = run_main(["completion", "bash"])
+        assert text.lstrip().startswith("_timetagger_complete")
+        assert journal.has_records()
+
+        # Run one command through to a function
+        response = {"records": []}
+        timetagger_cli.core.request = lambda method, path, body=None, **kwargs: response
         run_main(["status"])
 
-    # Other errors fall through
-    with raises(SystemExit):
-        run_main(["status", "status_func_has_no_args"])
-    assert excinfo.value.code == 2
 
-    # Run one command through to a function
-    response = {"records": []}
-    timetagger_cli.core.request = lambda method, path, body=None: response
-    run_main(["status"])
+def test_natural_language():
+    today = datetime.date.today()
+    assert __main__.date_from_natural_language("2024-02-29").day == 29
+    assert __main__.date_from_natural_language("today") == today
+    # Free-form input falls back to dateparser
+    week_ago = __main__.date_from_natural_language("1 week ago")
+    assert week_ago == today - datetime.timedelta(days=7)
+    assert __main__.time_from_natural_language("1230").hour == 12
+    with raises(ValueError):
+        __main__.date_from_natural_language("not a date at all")
+
+
+def get_import_times(argv):
+    """Get the cumulative import time (in us) of each top-level import,
+    and the set of all imported modules, for parsing the given
+    command-line arguments in a fresh process.
+    """
+    code = "from timetagger_cli.__main__ import setup_parser;"
+    code += f"setup_parser().parse_args({argv!r})"
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    p = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=root,
+        capture_output=True,
+        text=True,
+    )
+    assert p.returncode == 0, p.stderr
+    times, modules = {}, set()
+    for line in p.stderr.splitlines():
+        parts = line.partition(":")[2].split("|")
+        if line.startswith("import time:") and parts[1].strip().isdigit():
+            name = parts[2].strip()
+            modules.add(name)
+            if parts[2].startswith(" " + name):
+                times[name] = int(parts[1])
+    return times, modules
+
+
+def test_startup_time():
+    # The budget is generous, but catches heavy imports sneaking back in
+    budget = 200_000
+    for argv in (["--version"], ["status"], ["stop"]):
+        times, modules = get_import_times(argv)
+        assert "timetagger_cli.__main__" in modules
+        assert "dateparser" not in modules
+        assert "requests" not in modules
+        assert "toml" not in modules
+        total = sum(t for name, t in times.items() if name.startswith("timetagger"))
+        assert total < budget, f"Startup of {argv} took {total / 1000:.0f} ms"
 
 
 if __name__ == "__main__":
@@ -1,4 +1,7 @@
 import os
+import sys
+import json
+import time
 
 from timetagger_cli import config
 from pytest import raises
@@ -87,5 +90,48 @@ def test_load_config_fail():
         f.write(ori_text.encode())
 
 
+def test_load_config_cache():
+    ori_fname = config.config_fname
+    config.config_fname = "test_cache_config.txt"
+    filename = config.prepare_config_file()
+    cache_filename = os.path.join(config.get_config_dir(), config.cache_fname)
+
+    # A recently modified file is not cached
+    assert config.load_config()
+    assert not os.path.isfile(cache_filename)
+
+    # But once it's older, it is
+    t = time.time() - 10
+    os.utime(filename, (t, t))
+    d = config.load_config()
+    assert d["api_url"].startswith("https://timetagger.app")
+    assert os.path.isfile(cache_filename)
+    if not sys.platform.startswith("win"):
+        assert os.stat(cache_filename).st_mode & 0o077 == 0
+
+    # The cache file is used (in another process, or here after clearing memo)
+    with open(cache_filename, "rb") as f:
+        cache = json.loads(f.read().decode())
+    cache["config"]["api_url"] = "https://cached.com/api/v2/"
+    with open(cache_filename, "wb") as f:
+        f.write(json.dumps(cache).encode())
+    config._config_memo = None
+    assert config.load_config()["api_url"] == "https://cached.com/api/v2/"
+    assert config.load_config()["ssl_verify"] is True  # defaults are applied
+
+    # Changing the file invalidates the cache
+    with open(filename, "ab") as f:
+        f.write(b"\n# a comment\n")
+    os.utime(filename, (t + 1, t + 1))
+    assert config.load_config()["api_url"].startswith("https://timetagger.app")
+
+    # Explicit invalidation
+    config.invalidate_config_cache()
+    assert not os.path.isfile(cache_filename)
+
+    os.remove(filename)
+    config.config_fname = ori_fname
+
+
 if __name__ == "__main__":
     run_tests(globals())
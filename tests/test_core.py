@@ -1,14 +1,28 @@
-from argparse import Namespace
+import io
+import os
+import json
 import time
+import datetime
+import tempfile
+from argparse import Namespace
+from contextlib import redirect_stdout
 
-from timetagger_cli import core
-from _common import run_tests
+from timetagger_cli import core, config, journal
+from pytest import raises
+from _common import run_tests, temp_config_dir
 
+# Other tests replace core.request with a fake
+request = core.request
 
-def test_print_records():
-    lines = []
-    core.print = lambda *args: lines.append(" ".join(str(x) for x in args) + "\n")
 
+def capture_output(func, *args):
+    """Call the given function and return what it wrote to stdout."""
+    with redirect_stdout(io.StringIO()) as f:
+        func(*args)
+    return f.getvalue()
+
+
+def test_print_records():
     now = time.time()
 
     records = [
@@ -17,9 +31,8 @@ def test_print_records():
         dict(key="3", t1=now, t2=now + 3600, mt=now, st=0, ds="spam"),
         dict(key="4", t1=now, t2=now + 43200, mt=now, st=0),
     ]
-    core.print_records(records)
-
-    text = "\n".join(lines)
+    text = capture_output(core.print_records, records)
+    lines = text.splitlines()
 
     assert len(lines) == len(records) + 1
     for r in records:
@@ -30,108 +43,458 @@ def test_print_records():
     assert "1:00" in text
     assert "12:00" in text
 
+    # Ordered records can be streamed from an iterator
+    text2 = capture_output(core.print_records, iter(records), True)
+    assert text2 == text
+
+
+def test_get_session():
+    config = {"pool_size": 3}
+    session = core.get_session(config)
+    assert core.get_session(config) is session
+    assert session.get_adapter("https://timetagger.app")._pool_maxsize == 3
+    assert "gzip" in session.headers["Accept-Encoding"]
+
 
 def test_setup():
     core.open_with_os_default = lambda p: None
 
-    lines = []
-    core.print = lambda *args: lines.append(" ".join(str(x) for x in args) + "\n")
-
-    core.setup()
+    lines = capture_output(core.setup).splitlines()
 
     assert len(lines) == 2
 
 
 def test_start():
-    response = {"records": []}
-    core.request = lambda method, path, body=None: response
-
-    lines = []
-    core.print = lambda *args: lines.append(" ".join(str(x) for x in args) + "\n")
-
-    core.start(Namespace(description="foobar"))
+    with temp_config_dir():
+        response = {"records": []}
+        core.request = lambda method, path, body=None, **kwargs: response
 
-    text = "\n".join(lines)
-    lines.clear()
-    assert "foobar" in text
-    assert "started" in text.lower()
-    assert "and stopped" not in text.lower()
+        text = capture_output(core.start, Namespace(description="foobar"))
+        assert "foobar" in text
+        assert "started" in text.lower()
+        assert "and stopped" not in text.lower()
 
-    response["records"].append(dict(t1=3, t2=3))
-    core.start(Namespace(description="foobar"))
-
-    text = "\n".join(lines)
-    lines.clear()
-    assert "foobar" in text
-    assert "started" in text.lower()
-    assert "and stopped" in text.lower()
+        response["records"].append(dict(key="x", t1=3, t2=3))
+        text = capture_output(core.start, Namespace(description="foobar"))
+        assert "foobar" in text
+        assert "started" in text.lower()
+        assert "and stopped" in text.lower()
 
 
 def test_stop():
-    response = {"records": []}
-    core.request = lambda method, path, body=None: response
-
-    lines = []
-    core.print = lambda *args: lines.append(" ".join(str(x) for x in args) + "\n")
-
-    core.stop()
-
-    text = "\n".join(lines)
-    lines.clear()
-    assert "no running" in text.lower()
-    assert "stopped" not in text.lower()
-
-    response["records"].append(dict(t1=3, t2=3))
-    core.stop()
-
-    text = "\n".join(lines)
-    lines.clear()
-    assert "no running" not in text.lower()
-    assert "stopped" in text.lower()
+    with temp_config_dir():
+        response = {"records": []}
+        core.request = lambda method, path, body=None, **kwargs: response
+
+        text = capture_output(core.stop)
+        assert "no running" in text.lower()
+        assert "stopped" not in text.lower()
+
+        response["records"].append(dict(key="x", t1=3, t2=3))
+        text = capture_output(core.stop)
+        assert "no running" not in text.lower()
+        assert "stopped" in text.lower()
+
+
+def test_offline_writes():
+    with temp_config_dir():
+        server_records = {}
+        online = [False]
+
+        def request(method, path, body=None, **kwargs):
+            if not online[0]:
+                raise core.ServerUnavailable("Cannot connect")
+            if method == "PUT":
+                server_records.update({r["key"]: r for r in body})
+                return {
+                    "accepted": [r["key"] for r in body],
+                    "failed": [],
+                    "errors": [],
+                }
+            return {"records": list(server_records.values())}
+
+        core.request = request
+        core._flush_failed = False
+
+        # Starting a timer while offline saves it locally
+        text = capture_output(core.start, Namespace(description="offline"))
+        assert "started" in text.lower() and "saved locally" in text
+        assert journal.has_records()
+
+        # Reading commands see the local records
+        text = capture_output(core.stop)
+        assert "offline" in text and "stopping" in text.lower()
+        assert len(journal.read_records()) == 1
+        assert journal.read_records()[0]["t2"] > journal.read_records()[0]["t1"] - 1
+
+        # Pushed once the server is reachable
+        online[0] = True
+        text = capture_output(core.sync)
+        assert not journal.has_records()
+        assert len(server_records) == 1
+        assert list(server_records.values())[0]["ds"] == "offline"
+        assert "pushed" in text
+
+
+def test_queued_records_in_order():
+    with temp_config_dir():
+        records = [
+            dict(key="a", t1=100, t2=200, mt=0, ds="a"),
+            dict(key="c", t1=300, t2=400, mt=0, ds="c"),
+        ]
+        journal.append_records(
+            [
+                dict(key="b", t1=150, t2=250, mt=1, ds="b"),
+                dict(key="c", t1=50, t2=400, mt=1, ds="c changed"),
+            ]
+        )
+        result = core.with_queued_records(records, 0, 1000)
+        assert [r["key"] for r in result] == ["c", "a", "b"]
+        assert result[0]["ds"] == "c changed"
 
 
 def test_status():
+    with temp_config_dir():
+        now = int(time.time())
+
+        records = [
+            dict(key="1", t1=now - 60, t2=now, mt=now, st=0, ds="foo"),
+            dict(key="1", t1=now, t2=now + 60, mt=now, st=0, ds="foo"),
+            dict(key="2", t1=now - 3600, t2=now, mt=now, st=0, ds="bar"),
+            dict(key="3", t1=now - 3600, t2=now, mt=now, st=0, ds="HIDDEN removed"),
+            dict(
+                key="4", t1=now - 3600, t2=now, mt=now, st=0, ds="not removed HIDDEN "
+            ),
+        ]
+
+        response = {"records": records}
+        core.request = lambda method, path, body=None, **kwargs: response
+
+        text = capture_output(core.status)
+        assert "today:" in text and "this week:" in text
+        assert "running: n/a" in text.lower()
+        assert "not removed HIDDEN" in text
+        assert "HIDDEN removed" not in text
+
+        response["records"].append(dict(t1=now, t2=now))
+        text = capture_output(core.status)
+        assert "today:" in text and "this week:" in text
+        assert "running: 0:00" in text.lower()
+
+        response["records"].append(dict(t1=now, t2=now))
+        response["records"].append(dict(t1=now, t2=now))
+        text = capture_output(core.status)
+        assert "today:" in text and "this week:" in text
+        assert "3 running" in text.lower()
+
+
+def test_export():
+    with temp_config_dir():
+        now = int(time.time())
+        records = [
+            dict(key="2", t1=now - 60, t2=now, mt=now, st=0, ds="#foo, bar"),
+            dict(key="1", t1=now - 600, t2=now - 300, mt=now, st=0, ds="#a #b #a"),
+            dict(key="3", t1=now - 600, t2=now, mt=now, st=0, ds="HIDDEN removed"),
+        ]
+        core.request = lambda method, path, body=None, **kwargs: {"records": records}
+        args = dict(days=None, start=None, end=None, output=None, columns=None)
+
+        text = capture_output(core.export, Namespace(format="csv", **args))
+        lines = text.splitlines()
+        assert lines[0] == "key,t1,t2,duration,tags,ds"
+        assert lines[1] == f"1,{now - 600},{now - 300},300,#a #b,#a #b #a"
+        assert lines[2] == f'2,{now - 60},{now},60,#foo,"#foo, bar"'
+        assert len(lines) == 3
+
+        args["columns"] = "ds,duration"
+        text = capture_output(core.export, Namespace(format="tsv", **args))
+        assert text.splitlines() == ["ds\tduration", "#a #b #a\t300", "#foo, bar\t60"]
+
+        args["output"] = os.path.join(tempfile.mkdtemp(), "export.jsonl")
+        assert capture_output(core.export, Namespace(format="jsonl", **args)) == ""
+        with open(args["output"], "rb") as f:
+            lines = f.read().decode().splitlines()
+        assert [json.loads(line) for line in lines] == [
+            {"ds": "#a #b #a", "duration": 300},
+            {"ds": "#foo, bar", "duration": 60},
+        ]
+
+        args["columns"] = "ds,nope"
+        with raises(RuntimeError):
+            core.export(Namespace(format="csv", **args))
+
+
+def test_report():
+    with temp_config_dir():
+        start = datetime.datetime(2024, 3, 4, 12)  # a Monday
+        t = int(start.timestamp())
+        records = [
+            dict(key="1", t1=t, t2=t + 3600, mt=t, st=0, ds="#a #b"),
+            dict(key="2", t1=t + 86400, t2=t + 86400 + 1800, mt=t, st=0, ds="#B x"),
+            dict(key="3", t1=t - 1800, t2=t - 1800 + 3600 * 4, mt=t, st=0, ds="none"),
+            dict(key="4", t1=t, t2=t + 3600, mt=t, st=0, ds="HIDDEN #a"),
+        ]
+        core.request = lambda method, path, body=None, **kwargs: {"records": records}
+        args = dict(days=2, start=start.date(), end=None)
+
+        text = capture_output(core.report, Namespace(period=None, by="tag", **args))
+        lines = text.splitlines()[3:]
+        assert lines == [
+            " Duration  Tag",
+            "     5:30  total",
+            "     4:00  (untagged)",
+            "     1:30  #b",
+            "     1:00  #a",
+        ]
+
+        text = capture_output(
+            core.report, Namespace(period="day", by="combination", **args)
+        )
+        lines = text.splitlines()[3:]
+        assert lines == [
+            "Period      Duration  Tags",
+            "2024-03-04      5:00  total",
+            "                4:00  (untagged)",
+            "                1:00  #a #b",
+            "2024-03-05      0:30  total",
+            "                0:30  #b",
+        ]
+
+
+def test_request_retries():
+    import requests
+
+    class Response:
+        def __init__(self, status_code, headers=None):
+            self.status_code = status_code
+            self.headers = headers or {}
+            self.text = "oops"
+
+        def json(self):
+            return {"ok": True}
+
+    class Session:
+        def __init__(self, responses):
+            self.responses = responses
+            self.calls = []
+
+        def request(self, method, url, **kwargs):
+            self.calls.append((method, kwargs["timeout"]))
+            response = self.responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+    core.load_config = lambda: dict(
+        config.default_config,
+        api_url="https://example.com/api/v2/",
+        api_token="x",
+        retry_backoff=0.001,
+    )
+    try:
+        # Transient errors are retried, honoring Retry-After
+        core._deadline = None
+        core._session = session = Session(
+            [
+                requests.ConnectionError("reset"),
+                Response(503, {"Retry-After": "0"}),
+                Response(429, {"Retry-After": "0.01"}),
+                Response(200),
+            ]
+        )
+        t0 = time.monotonic()
+        assert request("GET", "records") == {"ok": True}
+        assert time.monotonic() - t0 >= 0.01
+        assert len(session.calls) == 4
+
+        # Until max_retries is reached
+        core._session = session = Session([Response(500)] * 10)
+        with raises(core.ServerUnavailable):
+            request("PUT", "records", [])
+        assert len(session.calls) == 4
+
+        # Client errors and non-idempotent requests are not retried
+        core._session = session = Session([Response(400)] * 10)
+        with raises(RuntimeError):
+            request("GET", "records")
+        core._session = session = Session([Response(500)] * 10)
+        with raises(core.ServerUnavailable):
+            request("POST", "records", [])
+        assert len(session.calls) == 1
+
+        # A Retry-After beyond the deadline fails right away
+        core._session = session = Session([Response(503, {"Retry-After": "999"})])
+        with raises(core.ServerUnavailable):
+            request("GET", "records")
+
+        # The timeouts are capped by the deadline, after which nothing is tried
+        core._deadline = time.monotonic() + 5
+        core._session = session = Session([Response(200)])
+        request("GET", "records")
+        assert session.calls[0][1][1] <= 5
+        core._deadline = time.monotonic() - 1
+        with raises(core.ServerUnavailable):
+            request("GET", "records")
+    finally:
+        core._deadline = None
+        core._session = None
+        core.load_config = config.load_config
+
+
+def test_parse_retry_after():
+    assert core.parse_retry_after(None) is None
+    assert core.parse_retry_after("bla") is None
+    assert core.parse_retry_after("12") == 12
+    assert core.parse_retry_after("-1") == 0
+    assert core.parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+    future = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(time.time() + 60))
+    assert 50 < core.parse_retry_after(future) <= 60
+
+
+def test_put_records():
+    core.load_config = lambda: {"batch_size": 3}
+    bodies = []
+    fails = [2]  # fail the 3rd request
+
+    def request(method, path, body=None, **kwargs):
+        bodies.append(body)
+        if len(bodies) in fails:
+            raise RuntimeError("500 - oops")
+        keys = [r["key"] for r in body]
+        return {"accepted": keys[1:], "failed": keys[:1], "errors": ["bad"]}
+
+    core.request = request
+    records = [dict(key=str(i), t1=i, t2=i) for i in range(7)]
+    with redirect_stdout(io.StringIO()) as f:
+        result = core.put_records(records)
+    # A failing batch is not retried here (request() retries transient errors)
+    assert [len(b) for b in bodies] == [3, 3, 1]
+    assert result["accepted"] == ["1", "2"]
+    assert result["failed"] == ["0", "3", "4", "5", "6"]
+    assert result["unpushed"] == ["3", "4", "5"]
+    assert "500 - oops" in result["errors"]
+    assert len(f.getvalue().splitlines()) == 3
+
+    core.load_config = config.load_config
+
+
+def test_iter_records_chunked():
+    day = 86400
+    server_records = [
+        dict(key="a", t1=0 * day, t2=0 * day + 10),
+        dict(key="b", t1=1 * day, t2=2 * day + 10),  # crosses a chunk boundary
+        dict(key="c", t1=2 * day + 20, t2=2 * day + 30),
+        dict(key="d", t1=5 * day, t2=9 * day),  # crosses multiple chunks
+        dict(key="e", t1=9 * day + 5, t2=9 * day + 5),  # running
+    ]
+    paths = []
+
+    def request(method, path, body=None, **kwargs):
+        paths.append(path)
+        t1, t2 = map(int, path.split("=")[1].split("-"))
+        records = [
+            r
+            for r in reversed(server_records)
+            if (r["t2"] >= t1 and r["t1"] <= t2) or (r["t1"] == r["t2"] <= t2)
+        ]
+        return {"records": records}
+
+    core.load_config = lambda: config.default_config | {
+        "fetch_chunk_days": 2,
+        "fetch_concurrency": 2,
+    }
+    core.request = request
+
+    records = core.get_records(0, 11 * day)
+    assert [r["key"] for r in records] == ["a", "b", "c", "d", "e"]
+    assert len(paths) == 6
+    assert paths[0] == f"records?timerange=0-{2 * day}"
+    assert paths[-1] == f"records?timerange={10 * day}-{11 * day}"
+
+    # Small ranges need a single request
+    paths.clear()
+    records = core.get_records(day, 2 * day)
+    assert [r["key"] for r in records] == ["b"]
+    assert len(paths) == 1
+
+    core.load_config = config.load_config
+
+
+def test_diagnose_fix():
     now = int(time.time())
-
     records = [
-        dict(key="1", t1=now - 60, t2=now, mt=now, st=0, ds="foo"),
-        dict(key="1", t1=now, t2=now + 60, mt=now, st=0, ds="foo"),
-        dict(key="2", t1=now - 3600, t2=now, mt=now, st=0, ds="bar"),
-        dict(key="3", t1=now - 3600, t2=now, mt=now, st=0, ds="HIDDEN removed"),
-        dict(key="4", t1=now - 3600, t2=now, mt=now, st=0, ds="not removed HIDDEN "),
+        dict(key="a", t1=now, t2=now - 60, mt=now, st=0, ds="swapped"),
+        dict(key="b", t1=-5, t2=10, mt=now, st=0, ds="negative"),
+        dict(key="c", t1=now - 60, t2=now, mt=now, st=0, ds="fine"),
     ]
+    pushed = []
 
-    response = {"records": records}
-    core.request = lambda method, path, body=None: response
+    def request(method, path, body=None, stream=False, **kwargs):
+        if method == "PUT":
+            pushed.extend(body)
+            return {"accepted": [r["key"] for r in body], "failed": [], "errors": []}
+        return iter(records) if stream else {"records": records}
 
-    lines = []
-    core.print = lambda *args: lines.append(" ".join(str(x) for x in args) + "\n")
+    core.load_config = lambda: {"batch_size": 1000, "use_local_store": False}
+    core.request = request
+    args = Namespace(fix=True, incremental=False, overlaps=False, fix_duplicates=False)
+    text = capture_output(core.diagnose, args)
+    assert "Updated 2 records" in text
+    assert [r["key"] for r in pushed] == ["b", "a"]
+    assert pushed[1]["t1"] == now - 60 and pushed[1]["t2"] == now
+    assert pushed[0]["t2"] - pushed[0]["t1"] == 15
 
-    core.status()
+    core.load_config = config.load_config
 
-    text = "\n".join(lines)
-    lines.clear()
-    assert "today:" in text and "this week:" in text
-    assert "running: n/a" in text.lower()
-    assert "not removed HIDDEN" in text
-    assert "HIDDEN removed" not in text
 
-    response["records"].append(dict(t1=now, t2=now))
-    core.status()
+def test_diagnose_same_prefix():
+    records = [
+        dict(key="b", t1=200, t2=300, mt=0, st=0, ds=""),
+        dict(key="a", t1=100, t2=200, mt=0, st=0, ds=""),
+    ]
+    core.request = lambda method, path, body=None, stream=False, **kwargs: iter(records)
+    core.load_config = lambda: {"use_local_store": False}
+    args = Namespace(fix=False, incremental=False, overlaps=False, fix_duplicates=False)
+    text = capture_output(core.diagnose, args)
+    assert text.index(": a, from") < text.index(": b, from")
 
-    text = "\n".join(lines)
-    lines.clear()
-    assert "today:" in text and "this week:" in text
-    assert "running: 0:00" in text.lower()
+    core.load_config = config.load_config
 
-    response["records"].append(dict(t1=now, t2=now))
-    response["records"].append(dict(t1=now, t2=now))
-    core.status()
 
-    text = "\n".join(lines)
-    lines.clear()
-    assert "today:" in text and "this week:" in text
-    assert "3 running" in text.lower()
+def test_diagnose_duplicates_and_overlaps():
+    now = int(time.time())
+    records = [
+        dict(key="a", t1=now - 900, t2=now - 600, mt=1, st=0, ds="#import"),
+        dict(key="b", t1=now - 900, t2=now - 600, mt=2, st=0, ds="#import"),
+        dict(key="c", t1=now - 890, t2=now - 600, mt=3, st=0, ds="#import"),
+        dict(key="d", t1=now - 700, t2=now - 300, mt=0, st=0, ds="other"),
+        dict(key="e", t1=now - 900, t2=now - 600, mt=0, st=0, ds="HIDDEN #import"),
+    ]
+    pushed = []
+
+    def request(method, path, body=None, stream=False, **kwargs):
+        if method == "PUT":
+            pushed.extend(body)
+            return {"accepted": [r["key"] for r in body], "failed": [], "errors": []}
+        return iter(records)
+
+    core.load_config = lambda: {"batch_size": 1000, "use_local_store": False}
+    core.request = request
+    args = Namespace(fix=False, incremental=False, overlaps=False, fix_duplicates=False)
+    text = capture_output(core.diagnose, args)
+    assert "exact duplicate of a: b, from" in text
+    assert "near duplicate of a: c, from" in text
+    assert "Found 3 pairs of overlapping records" in text
+    assert "All looks good" not in text
+
+    args.overlaps = args.fix_duplicates = True
+    text = capture_output(core.diagnose, args)
+    assert "overlaps with a: d, from" in text
+    assert "Removed 2 duplicate records" in text
+    assert sorted(r["key"] for r in pushed) == ["b", "c"]
+    assert all(r["ds"] == "HIDDEN #import" for r in pushed)
+
+    core.load_config = config.load_config
 
 
 if __name__ == "__main__":
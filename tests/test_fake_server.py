@@ -0,0 +1,395 @@
+"""
+End-to-end tests of the client, against a fake server over real HTTP.
+"""
+
+import io
+import os
+import json
+import time
+import pstats
+import tempfile
+from argparse import Namespace
+from contextlib import redirect_stdout, redirect_stderr
+
+from timetagger_cli import core, config, journal, checkpoint
+from timetagger_cli.store import RecordStore
+from timetagger_cli.__main__ import main
+from _fake_server import FakeServer, generate_records
+from _common import run_tests, temp_config_dir
+
+# Other tests replace core.request with a fake
+request = core.request
+
+# The temp_config_dir() context of the current test
+_config_dir_contexts = []
+
+
+def use_server(server, **options):
+    # Use a temporary config dir, so that the user's journal and other
+    # local files are not touched (the first time, in case of a reconfig)
+    if not _config_dir_contexts:
+        context = temp_config_dir()
+        context.__enter__()
+        _config_dir_contexts.append(context)
+    core.request = request
+    core.load_config = lambda: config.default_config | server.config(**options)
+    core._session = None
+    core._deadline = None
+    core._store = None
+
+
+def restore():
+    if _config_dir_contexts:
+        _config_dir_contexts.pop().__exit__(None, None, None)
+    core.load_config = config.load_config
+    core._session = None
+    core._deadline = None
+
+
+def test_fetch_records():
+    records = generate_records(1000)
+    with FakeServer(records) as server:
+        use_server(server, fetch_chunk_days=7)
+        try:
+            t1, t2 = records[0]["t1"], records[-1]["t2"]
+            fetched = list(core.iter_records(t1, t2))
+            assert [r["key"] for r in fetched] == [r["key"] for r in records]
+            assert len(server.requests) > 1  # fetched in chunks
+
+            assert len(core.get_all_records()) == 1000
+        finally:
+            restore()
+
+
+def test_push_records_in_batches():
+    with FakeServer() as server:
+        use_server(server, batch_size=100)
+        try:
+            records = generate_records(250)
+            records.append(dict(key="bad", t1=20, t2=10, mt=0, ds=""))
+            with redirect_stdout(io.StringIO()):
+                result = core.put_records(records)
+            assert len(result["accepted"]) == 250
+            assert result["failed"] == ["bad"]
+            assert "t1 is larger than t2" in result["errors"][0]
+            assert [r[0] for r in server.requests] == ["PUT"] * 3
+            assert len(server.records) == 250
+        finally:
+            restore()
+
+
+def test_retries():
+    with FakeServer(generate_records(10)) as server:
+        use_server(server, retry_backoff=0.001)
+        try:
+            server.fail_next(503, 429, retry_after=0)
+            assert len(core.get_all_records()) == 10
+            assert [r[2] for r in server.requests] == [503, 429, 200]
+
+            # An invalid token is not retried
+            use_server(server, api_token="wrong")
+            server.requests.clear()
+            try:
+                core.get_all_records()
+            except RuntimeError as err:
+                assert "401" in str(err)
+            else:
+                assert False, "expected an error"
+            assert len(server.requests) == 1
+        finally:
+            restore()
+
+
+def test_offline_then_online():
+    with FakeServer() as server:
+        use_server(server, retry_backoff=0.001)
+        core._flush_failed = False
+        # More failures than retries, for getting the running records. The
+        # record is then not pushed, but saved locally right away.
+        server.fail_next(*[500] * 4)
+        try:
+            with redirect_stdout(io.StringIO()) as f:
+                core.start(Namespace(description="#offline"))
+            assert "saved locally" in f.getvalue()
+            assert journal.has_records()
+            assert not server.records
+            assert [r[0] for r in server.requests] == ["GET"] * 4
+
+            with redirect_stdout(io.StringIO()) as f:
+                core.sync()
+            assert not journal.has_records()
+            assert [r["ds"] for r in server.records.values()] == ["#offline"]
+        finally:
+            core._flush_failed = False
+            restore()
+
+
+def test_store_sync():
+    filename = os.path.join(tempfile.mkdtemp(), "records.sqlite")
+    with FakeServer(generate_records(100)) as server:
+        use_server(server)
+        try:
+            store = RecordStore(filename)
+            assert store.sync(core.request) == 100
+            assert store.sync(core.request) == 0
+            r = dict(server.records["r0000005"], ds="#changed", mt=time.time())
+            server.put_records([r])
+            assert store.sync(core.request) == 1
+            assert store.get_all_records()[5]["ds"] == "#changed"
+            store.close()
+        finally:
+            restore()
+
+
+def test_response_cache():
+    now = time.time()
+    records = generate_records(20, now - 86400)
+    with FakeServer(records) as server:
+        use_server(server, response_cache=True, response_cache_ttl=60)
+        try:
+            t1, t2 = int(now - 86400), int(now)
+            keys1 = [r["key"] for r in core.get_records(t1, t2)]
+            assert [r[1].split("?")[0] for r in server.requests] == [
+                "/api/v2/updates",
+                "/api/v2/records",
+            ]
+
+            # A sub-range is served from the cache, without requests
+            server.requests.clear()
+            keys2 = [r["key"] for r in core.get_records(t1 + 8 * 3600, t2)]
+            assert set(keys2).issubset(keys1) and len(keys2) < len(keys1)
+            assert server.requests == []
+
+            # After pushing, the cache is validated with a small request
+            r = dict(records[-1], ds="#changed", mt=time.time())
+            with redirect_stdout(io.StringIO()):
+                core.put_records([r])
+            server.requests.clear()
+            changed = [r for r in core.get_records(t1, t2) if r["ds"] == "#changed"]
+            assert [r["key"] for r in changed] == [records[-1]["key"]]
+            assert len(server.requests) == 1
+            assert server.requests[0][1].startswith("/api/v2/updates?since=")
+            assert server.requests[0][3] < 1000  # bytes
+
+            # Changes by other clients are seen after the ttl
+            r = dict(records[-2], ds="#other", mt=time.time())
+            server.put_records([r])
+            assert not [r for r in core.get_records(t1, t2) if r["ds"] == "#other"]
+            use_server(server, response_cache=True, response_cache_ttl=0)
+            assert [r for r in core.get_records(t1, t2) if r["ds"] == "#other"]
+        finally:
+            restore()
+
+
+def test_running_cache():
+    with FakeServer() as server:
+        use_server(server, running_cache=True, running_cache_ttl=60)
+        try:
+            assert core.get_running_records() == []
+            methods = [r[0] + " " + r[1].split("?")[0] for r in server.requests]
+            assert methods == ["GET /api/v2/updates", "GET /api/v2/records"]
+            now = int(time.time())
+            one = dict(key="one", t1=now - 60, t2=now - 60, mt=now, st=0, ds="#one")
+            with redirect_stdout(io.StringIO()):
+                core.push_records([one])
+
+            # The running records are known locally
+            server.requests.clear()
+            with redirect_stdout(io.StringIO()) as f:
+                core.start(Namespace(description="#two"))
+            assert "#one" in f.getvalue()
+            assert [r[0] for r in server.requests] == ["PUT"]
+            assert [r["ds"] for r in core.get_running_records()] == ["#two"]
+
+            # A timer started by another client is seen once the state is stale
+            other = dict(key="other", t1=now, t2=now, mt=now, ds="#other")
+            server.put_records([other])
+            assert [r["ds"] for r in core.get_running_records()] == ["#two"]
+            use_server(server, running_cache=True, running_cache_ttl=0)
+            server.requests.clear()
+            running = sorted(r["ds"] for r in core.get_running_records())
+            assert running == ["#other", "#two"]
+            assert [r[1].split("?")[0] for r in server.requests] == ["/api/v2/updates"]
+
+            # Stopping is tracked locally too
+            stopped = [dict(r, t2=r["t1"] + 60) for r in core.get_running_records()]
+            with redirect_stdout(io.StringIO()):
+                core.push_records(stopped)
+            use_server(server, running_cache=True, running_cache_ttl=60)
+            assert core.get_running_records() == []
+            assert not any(r["t1"] == r["t2"] for r in server.records.values())
+
+            # Records that are pushed directly (e.g. by diagnose) are tracked too
+            three = dict(key="three", t1=now, t2=now, mt=now, st=0, ds="#three")
+            with redirect_stdout(io.StringIO()):
+                core.push_records([three])
+                core.put_records([dict(three, ds="HIDDEN #three")])
+            running = [r["ds"] for r in core.get_running_records()]
+            assert running == ["HIDDEN #three"]
+        finally:
+            restore()
+
+
+def test_timings_and_profile():
+    with FakeServer(generate_records(10, time.time() - 86400)) as server:
+        use_server(server)
+        try:
+            with redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()) as f:
+                main(["--timings", "show", "--days", "2"])
+            lines = f.getvalue().splitlines()
+            phases = [line.split()[0] for line in lines[1:]]
+            assert lines[0] == "Timings:"
+            assert phases[0] == "startup"
+            assert phases[-2:] == ["render", "total"]
+            assert {"config", "request", "decode"}.issubset(phases)
+            request_line = [line for line in lines if "request" in line][0]
+            assert "GET records?timerange=" in request_line
+            assert "-> 200" in request_line
+            assert not core.timings.enabled
+
+            filename = os.path.join(tempfile.mkdtemp(), "show.prof")
+            with redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()):
+                main(["--profile", filename, "show", "--days", "2"])
+            stats = pstats.Stats(filename)
+            assert any(func[2] == "show" for func in stats.stats)
+        finally:
+            restore()
+
+
+def test_import_records():
+    records = generate_records(250)
+    with FakeServer(records[:50]) as server:
+        use_server(server, batch_size=40, push_concurrency=3)
+        filename = os.path.join(tempfile.mkdtemp(), "records.csv")
+        with open(filename, "w", encoding="utf-8") as f:
+            f.write("key,t1,t2,ds\n")
+            for r in records:
+                f.write(f"{r['key']},{r['t1']},{r['t2']},\"{r['ds']}\"\n")
+            f.write(",2023-01-02T10:00:00,2023-01-02T11:00:00,no key\n")
+            f.write(",20,10,bad\n")
+            f.write(",,10,bad\n")
+            f.write(",nan,10,bad\n")
+            f.write(",10,inf,bad\n")
+        try:
+            # Dry run
+            args = Namespace(file=filename, format=None, dry_run=True)
+            with redirect_stdout(io.StringIO()) as f:
+                core.import_records(args)
+            assert "Would import 251 records" in f.getvalue()
+            assert "Row 252: t1 is larger than t2" in f.getvalue()
+            assert "Row 253: missing t1" in f.getvalue()
+            assert "Row 254: t1 is not a finite number" in f.getvalue()
+            assert "Row 255: t2 is not a finite number" in f.getvalue()
+            assert len(server.records) == 50
+
+            # Import, skipping the records that the server already has
+            args.dry_run = False
+            with redirect_stdout(io.StringIO()) as f:
+                core.import_records(args)
+            assert "Imported 201 records" in f.getvalue()
+            assert "Skipped 50 records that already exist" in f.getvalue()
+            assert len(server.records) == 251
+            puts = [x for x in server.requests if x[0] == "PUT"]
+            assert len(puts) == 6
+
+            # Importing again imports nothing
+            with redirect_stdout(io.StringIO()) as f:
+                core.import_records(args)
+            assert "Imported 0 records" in f.getvalue()
+            assert len(server.records) == 251
+        finally:
+            restore()
+
+
+def test_import_records_deadline():
+    # An import can take longer than the request_deadline
+    records = generate_records(60)
+    with FakeServer(latency=0.3) as server:
+        use_server(server, batch_size=10, push_concurrency=1, request_deadline=1)
+        filename = os.path.join(tempfile.mkdtemp(), "records.jsonl")
+        with open(filename, "w", encoding="utf-8") as f:
+            f.write("".join(json.dumps(r) + "\n" for r in records))
+            f.write('{"t1": 10, "t2": 20, "ds": "truncated\n')
+            f.write('["not", "an", "object"]\n')
+        try:
+            args = Namespace(file=filename, format=None, dry_run=False)
+            with redirect_stdout(io.StringIO()) as f:
+                core.import_records(args)
+            # Invalid lines are skipped, like invalid rows in a CSV file
+            assert "Imported 60 records" in f.getvalue()
+            assert "Skipped 2 invalid rows" in f.getvalue()
+            assert "Row 61: " in f.getvalue()
+            assert len(server.records) == 60
+        finally:
+            restore()
+
+
+def test_diagnose_streamed():
+    records = generate_records(3000)
+    records.append(dict(key="neg", t1=-5, t2=10, mt=0, st=0, ds=""))
+    with FakeServer(records) as server:
+        use_server(server)
+        try:
+            stream = core.request("GET", "updates?since=0", stream=True)
+            assert not isinstance(stream, (list, dict))
+            assert sum(1 for r in stream) == 3001
+
+            args = Namespace(
+                fix=False, incremental=False, overlaps=False, fix_duplicates=False
+            )
+            with redirect_stdout(io.StringIO()) as f:
+                core.diagnose(args)
+            assert "Checked 3001 records" in f.getvalue()
+            assert "negative timestamp:: neg" in f.getvalue()
+        finally:
+            restore()
+
+
+def test_diagnose_incremental():
+    now = time.time()
+    records = generate_records(1000)
+    records.append(dict(key="neg", t1=-5, t2=10, mt=0, st=0, ds=""))
+    records.append(dict(key="run", t1=now - 3600, t2=now - 3600, mt=0, st=0, ds=""))
+    with FakeServer(records) as server:
+        use_server(server)
+        args = Namespace(
+            fix=False, incremental=True, overlaps=False, fix_duplicates=False
+        )
+        try:
+            # The first run checks all records
+            with redirect_stdout(io.StringIO()) as f:
+                core.diagnose(args)
+            assert "Checked 1002 records" in f.getvalue()
+            assert "negative timestamp:: neg" in f.getvalue()
+
+            # The next run only gets the changes, but still shows flagged records
+            server.requests.clear()
+            with redirect_stdout(io.StringIO()) as f:
+                core.diagnose(args)
+            assert "Checking 0 records that changed" in f.getvalue()
+            assert "negative timestamp:: neg" in f.getvalue()
+            assert len(server.requests) == 1
+            assert server.requests[0][1].startswith("/api/v2/updates?since=")
+            assert server.requests[0][3] < 200
+
+            # Changed records are checked
+            server.put_records(
+                [
+                    dict(key="neg", t1=5, t2=10, mt=1, st=0, ds="fixed"),
+                    dict(key="run", t1=now - 3600, t2=now - 1800, mt=1, ds=""),
+                    dict(key="long", t1=now - 5 * 86400, t2=now, mt=1, ds=""),
+                ]
+            )
+            with redirect_stdout(io.StringIO()) as f:
+                core.diagnose(args)
+            assert "Checking 3 records that changed" in f.getvalue()
+            assert "negative timestamp" not in f.getvalue()
+            assert "duration over two days:: long" in f.getvalue()
+            state = checkpoint.load()
+            assert set(state["records"]) == {"neg", "long"}  # neg is early now
+        finally:
+            restore()
+
+
+if __name__ == "__main__":
+    run_tests(globals())
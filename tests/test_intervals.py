@@ -0,0 +1,41 @@
+from timetagger_cli.intervals import Intervals
+from pytest import raises
+from _common import run_tests
+
+
+def test_intervals():
+    x = Intervals([0, 10, 15, 40], [20, 30, 16, 50])
+    assert len(x) == 4
+    assert list(x.durations(0, 100)) == [20, 20, 1, 10]
+    assert list(x.durations(12, 45)) == [8, 18, 1, 5]
+    assert list(x.durations(60, 70)) == [0, 0, 0, 0]
+    assert x.total(0, 100) == 51
+    assert x.total(12, 45) == 32
+
+    x.append(100, 110)
+    assert x.total(0, 200) == 61
+
+    with raises(ValueError):
+        Intervals([1, 2], [3])
+
+
+def test_intervals_union():
+    x = Intervals([10, 0, 15, 40, 50], [30, 20, 16, 50, 55])
+    union = x.union()
+    assert list(union.t1) == [0, 40]
+    assert list(union.t2) == [30, 55]
+    assert union.total(0, 100) == 45
+    assert len(Intervals().union()) == 0
+
+
+def test_intervals_histogram():
+    x = Intervals([1, 12, 18, 5, -10], [2, 14, 35, 5, 100])
+    edges = [0, 10, 20, 30]
+    assert x.histogram(edges) == [11, 14, 20]
+    assert sum(x.histogram(edges)) == x.total(0, 30)
+    assert Intervals().histogram(edges) == [0, 0, 0]
+    assert x.histogram([40, 50]) == [10]
+
+
+if __name__ == "__main__":
+    run_tests(globals())
@@ -0,0 +1,50 @@
+import os
+import sys
+
+from timetagger_cli import journal
+from _common import run_tests
+
+
+def test_journal():
+    ori_fname = journal.journal_fname
+    journal.journal_fname = "test_journal.jsonl"
+    filename = journal.get_journal_filename()
+    if os.path.isfile(filename):
+        os.remove(filename)
+
+    assert not journal.has_records()
+    assert journal.read_records() == []
+
+    journal.append_records([dict(key="a", mt=1, ds="a1"), dict(key="b", mt=1)])
+    journal.append_records([dict(key="a", mt=3, ds="a3")])
+    journal.append_records([dict(key="a", mt=2, ds="a2")])
+    assert journal.has_records()
+    if not sys.platform.startswith("win"):
+        assert os.stat(filename).st_mode & 0o777 == 0o600
+
+    # Coalesced by key, the latest mt wins
+    records = journal.read_records()
+    assert [r["key"] for r in records] == ["a", "b"]
+    assert records[0]["ds"] == "a3"
+
+    # A partially written line is ignored
+    with open(filename, "ab") as f:
+        f.write(b'{"key": "c", "m')
+    assert len(journal.read_records()) == 2
+
+    # Records that changed after reading are not removed
+    journal.append_records([dict(key="b", mt=5)])
+    journal.remove_records(records)
+    assert journal.read_records() == [dict(key="b", mt=5)]
+    if not sys.platform.startswith("win"):
+        assert os.stat(filename).st_mode & 0o777 == 0o600
+
+    journal.remove_records([dict(key="b", mt=5)])
+    assert not journal.has_records()
+
+    os.remove(filename)
+    journal.journal_fname = ori_fname
+
+
+if __name__ == "__main__":
+    run_tests(globals())
@@ -0,0 +1,50 @@
+import json
+
+from timetagger_cli.jsonstream import iter_array
+from _common import run_tests
+
+
+def split(data, size):
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+def test_iter_array():
+    ob = {
+        "server_time": 1712345678.125,
+        "reset": False,
+        "nested": {"records": [1, 2], "x": "}]"},
+        "records": [
+            {"key": "a", "t1": 100, "t2": 12345678, "ds": "caf\u00e9 \u2615"},
+            {"key": "b", "t1": -5, "t2": 1e3, "ds": 'quote " and \\ , ]'},
+            {"key": "c", "t1": 0, "t2": 0.5, "ds": ""},
+        ],
+        "after": [None, True],
+    }
+    for text in (json.dumps(ob), json.dumps(ob, indent=2, ensure_ascii=False)):
+        data = text.encode()
+        # Split at every possible position, including inside characters
+        for size in (1, 2, 3, 7, 64, len(data)):
+            records = list(iter_array(split(data, size), "records"))
+            assert records == ob["records"], size
+
+
+def test_iter_array_edge_cases():
+    assert list(iter_array([b"{}"], "records")) == []
+    assert list(iter_array([b'{"records": []}'], "records")) == []
+    assert list(iter_array([b" {", b'"records"', b":[1 ,", b"22]} "], "records")) == [
+        1,
+        22,
+    ]
+    assert list(iter_array([b'{"records": 3}'], "records")) == []
+
+    for data in (b"", b"[]", b'{"records": [1, 2', b'{"records": [1 2]}'):
+        try:
+            list(iter_array([data], "records"))
+        except ValueError:
+            pass
+        else:
+            assert False, data
+
+
+if __name__ == "__main__":
+    run_tests(globals())
@@ -0,0 +1,119 @@
+import sys
+import json
+import datetime
+
+from timetagger_cli import utils
+from timetagger_cli.records import Record, RecordBatch
+from _common import run_tests
+
+
+def test_record():
+    d = dict(key="a", t1=10, t2=70, mt=80, st=90, ds="#Foo on #bar")
+    r = Record.from_dict(d)
+    assert (r.key, r.t1, r.t2, r.mt, r.st, r.ds) == ("a", 10, 70, 80, 90, d["ds"])
+    assert r.to_dict() == d
+    assert r.tags == ("#foo", "#bar")
+    assert r.duration == 60
+    assert not r.running and not r.hidden
+
+    r = Record.from_dict(dict(key="b", t1=10, t2=10))
+    assert r.ds == "" and r.running and r.duration > 1000
+    assert r.tags == ()
+
+    # No dict per record
+    try:
+        r.foo = 3
+    except AttributeError:
+        pass
+    else:
+        assert False
+
+
+def test_record_batch():
+    records = [
+        dict(key="a", t1=300, t2=400, ds="#foo"),
+        dict(key="b", t1=100, t2=200, ds="HIDDEN #foo"),
+        dict(key="c", t1=150, t2=150, ds="running"),
+    ]
+    batch = RecordBatch(records)
+    assert len(batch) == 3 and batch[0].key == "a"
+    assert RecordBatch(batch).records == batch.records
+    assert [r.key for r in batch.sorted()] == ["b", "c", "a"]
+    assert [r.key for r in batch.visible()] == ["a", "c"]
+    assert [r.key for r in batch.running()] == ["c"]
+    assert [r.key for r in batch.overlapping(190, 350)] == ["a", "b", "c"]
+    assert [r.key for r in batch.overlapping(0, 120)] == ["b"]
+    assert [r.key for r in batch[1:]] == ["b", "c"]
+    assert [d["key"] for d in batch.to_dicts()] == ["a", "b", "c"]
+
+    intervals = batch.intervals(now=500)
+    assert list(intervals.t1) == [300, 100, 150]
+    assert list(intervals.t2) == [400, 200, 500]
+
+    start = datetime.datetime.fromtimestamp(0)
+    end = datetime.datetime.fromtimestamp(450)
+    assert utils.total_time(batch, start, end) == 100 + 100 + 300
+    assert utils.total_time(records, start, end) == 100 + 100 + 300
+
+
+def test_record_memory():
+    # A record as decoded from the API, vs as a Record (the values are shared)
+    d = json.loads(json.dumps(dict(key="k", t1=1, t2=2, mt=3, st=4, ds="x")))
+    r = Record.from_dict(d)
+    assert not hasattr(r, "__dict__")
+    assert sys.getsizeof(r) < 0.5 * sys.getsizeof(d)
+
+
+def test_overlaps():
+    batch = RecordBatch(
+        [
+            dict(key="c", t1=250, t2=260),
+            dict(key="a", t1=100, t2=300),
+            dict(key="b", t1=200, t2=400),
+            dict(key="d", t1=400, t2=500),  # touches b, does not overlap
+            dict(key="e", t1=450, t2=450),  # running
+        ]
+    )
+    pairs = [(r1.key, r2.key) for r1, r2 in batch.overlaps()]
+    assert pairs == [("a", "b"), ("a", "c"), ("b", "c")]
+
+    # Many records, compared with the naive way
+    import random
+
+    rng = random.Random(0)
+    records = []
+    for i in range(300):
+        t1 = rng.randint(0, 100000)
+        records.append(dict(key=str(i), t1=t1, t2=t1 + rng.randint(1, 2000)))
+    expected = {
+        tuple(sorted([r1["key"], r2["key"]]))
+        for i, r1 in enumerate(records)
+        for r2 in records[i + 1 :]
+        if r1["t1"] < r2["t2"] and r2["t1"] < r1["t2"]
+    }
+    pairs = RecordBatch(records).overlaps()
+    assert len(pairs) == len(expected)
+    assert {tuple(sorted([r1.key, r2.key])) for r1, r2 in pairs} == expected
+    assert all(r1.t1 <= r2.t1 for r1, r2 in pairs)
+
+
+def test_duplicates():
+    batch = RecordBatch(
+        [
+            dict(key="a", t1=100, t2=200, ds="#foo"),
+            dict(key="b", t1=100, t2=200, ds="#foo"),
+            dict(key="c", t1=130, t2=190, ds="#foo "),
+            dict(key="d", t1=100, t2=200, ds="#bar"),
+            dict(key="e", t1=200, t2=300, ds="#foo"),
+            dict(key="f", t1=1000, t2=1000, ds=""),
+            dict(key="g", t1=1000, t2=1000, ds=""),
+        ]
+    )
+    groups = [[r.key for r in group] for group in batch.duplicates()]
+    assert groups == [["a", "b"], ["f", "g"]]
+    groups = [[r.key for r in group] for group in batch.duplicates(60)]
+    assert groups == [["a", "b", "c"], ["f", "g"]]
+
+
+if __name__ == "__main__":
+    run_tests(globals())
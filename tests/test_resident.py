@@ -0,0 +1,128 @@
+import io
+import os
+import time
+import socket
+import tempfile
+import threading
+from contextlib import redirect_stdout, redirect_stderr
+
+from timetagger_cli import core, config, resident
+from timetagger_cli.__main__ import main
+from pytest import raises, mark
+from _common import run_tests, temp_config_dir
+
+# The daemon uses Unix domain sockets, which e.g. Windows may not have
+needs_unix_sockets = mark.skipif(
+    not hasattr(socket, "AF_UNIX"), reason="needs Unix domain sockets"
+)
+
+
+@needs_unix_sockets
+def test_forward_without_daemon():
+    path = os.path.join(tempfile.mkdtemp(), "daemon.sock")
+    assert resident.forward(["status"], path) is None
+
+    # A stale socket file is ignored
+    with open(path, "wb"):
+        pass
+    assert resident.forward(["status"], path) is None
+
+
+def test_forward_unless_measured():
+    forwarded = []
+
+    def forward(argv, path=None):
+        forwarded.append(argv)
+        return {"output": "", "error": "", "exit": 0}
+
+    resident_forward = resident.forward
+    resident.forward = forward
+    real_request = core.request
+    core.request = lambda method, path, body=None, **kwargs: {"records": []}
+    try:
+        with temp_config_dir():
+            main(["status"])
+            assert forwarded == [["status"]]
+
+            # Commands that are measured run in this process
+            with redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()):
+                main(["--timings", "status"])
+                main(["--profile", os.devnull, "status"])
+            assert forwarded == [["status"]]
+    finally:
+        resident.forward = resident_forward
+        core.request = real_request
+
+
+@needs_unix_sockets
+def test_daemon():
+    now = time.time()
+    path = os.path.join(tempfile.mkdtemp(), "daemon.sock")
+    calls = []
+
+    def request(method, path, body=None, **kwargs):
+        calls.append((method, path))
+        records = [dict(key="a", t1=now - 60, t2=now - 60, mt=1, st=1, ds="#daemon")]
+        return {"server_time": now, "reset": False, "records": records}
+
+    real_request = core.request
+    core.request = request
+    core.load_config = lambda: dict(config.default_config, api_url="", api_token="")
+
+    server = resident.Daemon(path, sync_interval=60)
+    server.poll_interval = 0.05
+    thread = threading.Thread(target=server.serve)
+    thread.start()
+    try:
+        for _ in range(100):
+            if os.path.exists(path):
+                break
+            time.sleep(0.01)
+
+        # The daemon runs the command, with the records it has in memory
+        calls.clear()
+        result = resident.forward(["status"], path)
+        assert result["exit"] == 0
+        assert "#daemon" in result["output"]
+        assert calls == []
+
+        # Errors are reported as the CLI would
+        result = resident.forward(["report", "--days", "x"], path)
+        assert result["exit"] == 2
+        assert "invalid int value" in result["error"]
+
+        # Commands that may ask for input are not run by the daemon
+        for argv in (["resume"], ["--timings", "setup"]):
+            result = resident.forward(argv, path)
+            assert result["exit"]
+            assert result["output"] == ""
+        result = resident.forward(["--timings", "resume"], path)
+        assert "does not run 'resume'" in result["exit"]
+
+        # Only one daemon can run
+        with raises(RuntimeError):
+            resident.Daemon(path).serve()
+
+        # The CLI forwards commands
+        resident_get_socket_path = resident.get_socket_path
+        resident.get_socket_path = lambda: path
+        try:
+            with redirect_stdout(io.StringIO()) as f:
+                main(["status"])
+            assert "#daemon" in f.getvalue()
+            assert calls == []
+        finally:
+            resident.get_socket_path = resident_get_socket_path
+
+    finally:
+        server.stop()
+        thread.join()
+        core.request = real_request
+        core.load_config = config.load_config
+
+    assert not os.path.exists(path)
+    assert core._store is None
+
+
+if __name__ == "__main__":
+    run_tests(globals())
@@ -0,0 +1,124 @@
+import io
+import os
+import sys
+import time
+import subprocess
+from argparse import Namespace
+from contextlib import redirect_stdout
+
+from timetagger_cli import core, config, shell_completion
+from timetagger_cli.utils import get_tags
+from _common import run_tests, temp_config_dir
+
+request_real = core.request
+
+
+index = {
+    "tags": ["#work", "#code", "#writing"],
+    "descriptions": ["#work on cli", "#code review", "Lunch"],
+    "recent": ["#code review", "Lunch"],
+}
+
+
+def complete(*words):
+    return shell_completion.get_completions(["timetagger", *words], index)
+
+
+def test_get_completions():
+    # Commands
+    assert complete("st") == ["status", "start", "stop"]
+    assert complete("--t") == ["--timings"]
+    assert complete("--profile", "x.prof", "res") == ["resume"]
+
+    # Descriptions and tags
+    assert complete("start", "") == index["descriptions"]
+    assert complete("start", "lu") == ["Lunch"]
+    assert complete("start", "#w") == ["#work", "#writing"]
+    assert complete("start", "#code on #W") == ["#code on #work", "#code on #writing"]
+    assert complete("start", '"#co') == ["#code"]
+    assert complete("add", "10:00", "11:00", "#c") == ["#code"]
+    assert complete("add", "--date", "today", "10:00", "") == []
+    assert complete("start", "#work", "") == []
+
+    # Recent records to resume
+    assert complete("resume", "") == ["1\t#code review", "2\tLunch"]
+
+
+def test_build_index():
+    day = 86400
+    now = 100 * day
+    records = [
+        dict(t1=now - 90 * day, t2=now - 90 * day + 60, ds="#old"),
+        dict(t1=now - 80 * day, t2=now - 80 * day + 60, ds="#old"),
+        dict(t1=now - 2 * day, t2=now - 2 * day + 60, ds="#new"),
+        dict(t1=now - 1 * day, t2=now - 1 * day + 60, ds="  "),
+        dict(t1=now - 3 * day, t2=now - 3 * day + 60, ds="#new (HIDDEN)"),
+        dict(t1=now - 60, t2=now - 60, ds="#running"),
+    ]
+    result = shell_completion.build_index(records, get_tags, now)
+    # Recent use weighs more than frequent use long ago
+    assert result["tags"][:2] == ["#new", "#running"]
+    assert result["descriptions"][:2] == ["#running", "#new"]
+    # The records to resume are those that 'resume' lists, most recent first
+    assert result["recent"] == ["#running", "  ", "#new"]
+
+
+def test_complete_and_refresh():
+    core.load_config = lambda: dict(config.default_config, use_local_store=False)
+    now = time.time()
+    records = [
+        dict(key="a", t1=now - 60, t2=now, mt=now, st=1, ds="#cli work"),
+        dict(key="b", t1=now - 60, t2=now, mt=now, st=1, ds="HIDDEN #secret"),
+        dict(key="c", t1=now - 999 * 86400, t2=now - 998 * 86400, ds="#ancient"),
+    ]
+    paths = []
+
+    def request(method, path, body=None):
+        paths.append(path)
+        t1, t2 = map(float, path.partition("=")[2].split("-"))
+        return {"records": [r for r in records if r["t1"] < t2 and r["t2"] > t1]}
+
+    try:
+        with temp_config_dir() as config_dir:
+            # Without a local store, only the recent records are fetched
+            core.request = request
+            with redirect_stdout(io.StringIO()) as f:
+                core.completion(Namespace(refresh=True, shell=None))
+            assert "Indexed 1 tags and 1 descriptions" in f.getvalue()
+            if not sys.platform.startswith("win"):
+                filename = shell_completion.get_index_filename()
+                assert os.stat(filename).st_mode & 0o777 == 0o600
+            assert all(p.startswith("records?timerange=") for p in paths)
+            assert not os.path.exists(os.path.join(config_dir, "records.sqlite"))
+
+            with redirect_stdout(io.StringIO()) as f:
+                shell_completion.complete(["timetagger", "start", "#c"])
+            assert f.getvalue() == "#cli\n"
+
+            # The completion path does not import slow modules
+            code = "import sys, timetagger_cli.config as c; from timetagger_cli.__main__ import main;"
+            code += f"c._config_dir = {config_dir!r};"
+            code += "main(['__complete', 'timetagger', 'start', '#']);"
+            code += "print(' '.join(sys.modules))"
+            root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            p = subprocess.run(
+                [sys.executable, "-c", code], cwd=root, capture_output=True, text=True
+            )
+            lines = p.stdout.splitlines()
+            assert lines[0] == "#cli"
+            for name in ("requests", "dateparser", "toml", "sqlite3", "subprocess"):
+                assert name not in lines[1].split()
+    finally:
+        core.load_config = config.load_config
+        core.request = request_real
+
+
+def test_completion_scripts():
+    for shell in ("bash", "zsh", "fish"):
+        with redirect_stdout(io.StringIO()) as f:
+            core.completion(Namespace(refresh=False, shell=shell))
+        assert "timetagger __complete" in f.getvalue()
+
+
+if __name__ == "__main__":
+    run_tests(globals())
@@ -0,0 +1,84 @@
+import os
+import sys
+import sqlite3
+import tempfile
+
+from timetagger_cli.store import RecordStore
+from _common import run_tests
+
+
+def test_store_sync():
+    filename = os.path.join(tempfile.mkdtemp(), "records.sqlite")
+
+    server_records = {}
+    calls = []
+
+    def request(method, path, body=None):
+        calls.append(path)
+        since = float(path.split("=")[1])
+        records = [r for r in server_records.values() if r["st"] > since]
+        return {"server_time": 100 + len(calls), "reset": False, "records": records}
+
+    server_records["a"] = dict(key="a", t1=10, t2=20, mt=1, st=50, ds="foo")
+    server_records["b"] = dict(key="b", t1=30, t2=30, mt=1, st=50, ds="bar")
+
+    store = RecordStore(filename)
+    assert store.server_time == 0
+    if not sys.platform.startswith("win"):
+        assert os.stat(filename).st_mode & 0o777 == 0o600
+    assert store.sync(request) == 2
+    assert calls[-1] == "updates?since=0"
+    assert store.server_time == 101
+
+    # Only changes are pulled
+    assert store.sync(request) == 0
+    assert calls[-1] == "updates?since=101"
+    server_records["a"] = dict(key="a", t1=10, t2=25, mt=2, st=150, ds="foo")
+    assert store.sync(request) == 1
+    store.close()
+
+    # The store persists
+    store = RecordStore(filename)
+    assert store.server_time == 103
+    assert [r["key"] for r in store.get_all_records()] == ["a", "b"]
+    assert store.get_all_records()[0]["t2"] == 25
+    assert [r["key"] for r in store.get_running_records()] == ["b"]
+
+    # Time range queries, running records are included when started earlier
+    assert [r["key"] for r in store.get_records(0, 5)] == []
+    assert [r["key"] for r in store.get_records(0, 15)] == ["a"]
+    assert [r["key"] for r in store.get_records(22, 28)] == ["a"]
+    assert [r["key"] for r in store.get_records(40, 50)] == ["b"]
+
+    # A reset clears the store
+    store.sync(lambda *args: {"server_time": 200, "reset": True, "records": []})
+    assert store.get_all_records() == []
+    store.close()
+
+
+def test_store_tags():
+    filename = os.path.join(tempfile.mkdtemp(), "records.sqlite")
+
+    # A store from before the tags column was added
+    db = sqlite3.connect(filename)
+    db.execute(
+        "CREATE TABLE records (key TEXT PRIMARY KEY, "
+        "t1 NUMERIC, t2 NUMERIC, mt NUMERIC, st NUMERIC, ds TEXT)"
+    )
+    with db:
+        db.execute("INSERT INTO records VALUES ('a', 10, 20, 0, 0, '#Foo bar')")
+    db.close()
+
+    store = RecordStore(filename)
+    store.put_records([dict(key="b", t1=30, t2=40, mt=0, st=0, ds="#x #y")])
+    store.put_records([dict(key="c", t1=30, t2=40, mt=0, st=0, ds="HIDDEN #x")])
+    assert store.get_tagged_intervals(0, 100) == [
+        (10, 20, ("#foo",)),
+        (30, 40, ("#x", "#y")),
+    ]
+    assert "tags" not in store.get_all_records()[0]
+    store.close()
+
+
+if __name__ == "__main__":
+    run_tests(globals())
@@ -1,7 +1,11 @@
 import os
+import sys
 import time
+import tempfile
+import datetime
 
 from timetagger_cli import utils
+from pytest import raises
 from _common import run_tests
 
 
@@ -27,6 +31,72 @@ def test_user_config_dir():
     assert path1 != path2
 
 
+def test_read_and_write_state():
+    filename = os.path.join(tempfile.mkdtemp(), "state.json")
+    default = {"version": 2, "items": []}
+    assert utils.read_state(filename, default) == default
+
+    utils.write_private(filename, {"version": 2, "items": [1]})
+    assert utils.read_state(filename, default) == {"version": 2, "items": [1]}
+    if not sys.platform.startswith("win"):
+        assert os.stat(filename).st_mode & 0o777 == 0o600
+
+    # Another version, or an invalid file, gives the default
+    utils.write_private(filename, {"version": 1, "items": [1]})
+    assert utils.read_state(filename, default) == default
+    with open(filename, "wb") as f:
+        f.write(b"[1, 2")
+    assert utils.read_state(filename, default) == default
+
+
+def test_get_tags():
+    assert utils.get_tags("") == ()
+    assert utils.get_tags("no tags") == ()
+    assert utils.get_tags("#foo bar #Spam-eggs") == ("#foo", "#spam-eggs")
+    assert utils.get_tags("#b, (#a) #b. #c!") == ("#b", "#a", "#c")
+
+
+def test_get_period_edges():
+    dt = datetime.datetime
+    start, end = dt(2024, 1, 30, 12), dt(2024, 3, 5, 8)
+
+    edges = utils.get_period_edges(start, end, "day")
+    assert len(edges) == 37
+    assert edges[:2] == [start, dt(2024, 1, 31)]
+    assert edges[-2:] == [dt(2024, 3, 5), end]
+
+    edges = utils.get_period_edges(start, end, "week")
+    assert len(edges) == 7
+    assert edges[:3] == [start, dt(2024, 2, 5), dt(2024, 2, 12)]
+    assert edges[-2:] == [dt(2024, 3, 4), end]
+    assert utils.readable_period(edges[1], "week") == "2024-W06"
+
+    edges = utils.get_period_edges(start, end, "month")
+    assert edges == [start, dt(2024, 2, 1), dt(2024, 3, 1), end]
+    assert utils.readable_period(edges[1], "month") == "2024-02"
+    assert utils.readable_period(edges[1], "day") == "2024-02-01"
+
+    edges = utils.get_period_edges(start, dt(2024, 1, 30, 18), "month")
+    assert edges == [start, dt(2024, 1, 30, 18)]
+
+
+def test_total_time():
+    now = datetime.datetime.now().replace(microsecond=0)
+    t = int(now.timestamp())
+    start = now - datetime.timedelta(hours=2)
+    end = now + datetime.timedelta(hours=2)
+    records = [
+        dict(t1=t - 3600, t2=t - 1800),
+        dict(t1=t - 2700, t2=t - 900),  # overlaps the previous
+        dict(t1=t - 3 * 3600, t2=t - 6600),  # partly before start
+        dict(t1=t - 600, t2=t - 600),  # running
+    ]
+    total = utils.total_time(records, start, end)
+    assert 1800 + 1800 + 600 + 600 <= total < 4800 + 5
+    total = utils.total_time(records, start, end, merge_overlaps=True)
+    assert 2700 + 600 + 600 <= total < 3900 + 5
+
+
 def test_readable_time():
     x = utils.readable_time(time.time())
     assert isinstance(x, str)
@@ -35,6 +105,14 @@ def test_readable_time():
     assert len(x) == 16
 
 
+def test_readable_time_formatter():
+    split_time = utils.ReadableTimeFormatter()
+    t = time.time() - 86400 * 400
+    for i in range(2000):
+        t += 3 * 3607.3
+        assert " ".join(split_time(t)) == utils.readable_time(t)
+
+
 def test_readable_duration():
     assert utils.readable_duration(0) == "0:00"
     assert utils.readable_duration(29) == "0:00"
@@ -44,5 +122,37 @@ def test_readable_duration():
     assert utils.readable_duration(42 * 3600 + 14 * 60) == "42:14"
 
 
+def test_parse_date():
+    sunday = datetime.date(2024, 3, 10)
+    assert utils.parse_date("2024-02-29") == datetime.date(2024, 2, 29)
+    assert utils.parse_date(" Today ", sunday) == sunday
+    assert utils.parse_date("yesterday", sunday) == datetime.date(2024, 3, 9)
+    assert utils.parse_date("tomorrow", sunday) == datetime.date(2024, 3, 11)
+    assert utils.parse_date("sunday", sunday) == sunday
+    assert utils.parse_date("monday", sunday) == datetime.date(2024, 3, 4)
+    assert utils.parse_date("sat", sunday) == datetime.date(2024, 3, 9)
+    assert utils.parse_date("-3d", sunday) == datetime.date(2024, 3, 7)
+    assert utils.parse_date("+1w", sunday) == datetime.date(2024, 3, 17)
+    assert utils.parse_date("today") == datetime.date.today()
+
+    for s in ("", "2024-02-30", "su", "3 days ago", "next week"):
+        assert utils.parse_date(s) is None
+    for s in ("-999999999d", "+99999999999w"):
+        with raises(ValueError):
+            utils.parse_date(s)
+
+
+def test_parse_time():
+    assert utils.parse_time("12:30") == datetime.time(12, 30)
+    assert utils.parse_time("1230") == datetime.time(12, 30)
+    assert utils.parse_time("9:05") == datetime.time(9, 5)
+    assert utils.parse_time("905") == datetime.time(9, 5)
+    assert utils.parse_time("23:59:58") == datetime.time(23, 59, 58)
+    assert isinstance(utils.parse_time("now"), datetime.time)
+
+    for s in ("", "24:00", "12:60", "1", "12345", "noon"):
+        assert utils.parse_time(s) is None
+
+
 if __name__ == "__main__":
     run_tests(globals())
@@ -6,4 +6,25 @@ __version__ = "25.5.1"
 
 version_info = tuple(map(int, __version__.split(".")))
 
-from .core import app, setup, status, show, start, stop, add, resume, diagnose  # noqa
+commands = [
+    "app",
+    "setup",
+    "status",
+    "show",
+    "export",
+    "import_records",
+    "report",
+    "start",
+    "stop",
+    "add",
+    "resume",
+    "sync",
+    "daemon",
+    "completion",
+    "diagnose",
+]
+
+from . import core  # noqa
+
+# The command functions, e.g. timetagger_cli.start
+globals().update((name, getattr(core, name)) for name in commands)
@@ -2,11 +2,14 @@
 The CLI logic.
 """
 
+import os
 import sys
+import time
 import argparse
 
-import dateparser
 import timetagger_cli
+from timetagger_cli import journal, resident, timings, shell_completion
+from timetagger_cli.utils import parse_date, parse_time
 
 
 # %%
@@ -14,21 +17,57 @@ import timetagger_cli
 
 def date_from_natural_language(string):
     """convert string to date object"""
-    return dateparser.parse(string).date()
+    date = parse_date(string)
+    if date is None:
+        import dateparser  # slow to import, so only do it when needed
+
+        dt = dateparser.parse(string)
+        if dt is None:
+            raise ValueError(f"Cannot parse date {string!r}")
+        date = dt.date()
+    return date
 
 
 def time_from_natural_language(string):
     """convert string to time object"""
-    return dateparser.parse(string).time()
+    time = parse_time(string)
+    if time is None:
+        import dateparser  # slow to import, so only do it when needed
+
+        dt = dateparser.parse(string)
+        if dt is None:
+            raise ValueError(f"Cannot parse time {string!r}")
+        time = dt.time()
+    return time
 
 
-def create_command_parser(subparsers, func):
+def create_command_parser(subparsers, func, name=None, description=None):
     """helper function to create a argparse subparser"""
-    parser = subparsers.add_parser(func.__name__, help=func.__doc__.strip())
+    name = name or func.__name__
+    summary = func.__doc__.strip()
+    description = f"{summary} {description}" if description else None
+    parser = subparsers.add_parser(name, help=summary, description=description)
     parser.set_defaults(func=func)
     return parser
 
 
+def add_time_range_arguments(parser):
+    """helper function to add the arguments to select a time range"""
+    parser.add_argument(
+        "--days", type=int, help="Select records of the last <DAYS> days. Default: 1"
+    )
+    parser.add_argument(
+        "--start",
+        type=date_from_natural_language,
+        help="Start date in ISO-format (YYYY-MM-DD), or e.g. 'monday' or '-3d'.",
+    )
+    parser.add_argument(
+        "--end",
+        type=date_from_natural_language,
+        help="End date in ISO-format (YYYY-MM-DD), or e.g. 'yesterday'.",
+    )
+
+
 def setup_parser():
     """setup argument parsing"""
     argparser = argparse.ArgumentParser(
@@ -41,6 +80,16 @@ def setup_parser():
         action="version",
         version=f"timetagger_cli v{timetagger_cli.__version__}",
     )
+    argparser.add_argument(
+        "--timings",
+        action="store_true",
+        help="show how much time the phases of the command took",
+    )
+    argparser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="save a profile of the command to a pstats file",
+    )
 
     subparsers = argparser.add_subparsers()
 
@@ -51,22 +100,73 @@ def setup_parser():
     create_command_parser(subparsers, timetagger_cli.status)
 
     show = create_command_parser(subparsers, timetagger_cli.show)
-    show.add_argument(
-        "--days", type=int, help="Show records of the last <DAYS> days. Default: 1"
+    add_time_range_arguments(show)
+
+    export = create_command_parser(subparsers, timetagger_cli.export)
+    add_time_range_arguments(export)
+    export.add_argument(
+        "--format",
+        choices=["csv", "tsv", "jsonl"],
+        default="csv",
+        help="Output format. Default: csv",
     )
-    show.add_argument(
-        "--start",
-        type=date_from_natural_language,
-        help="Start date in ISO-format (YYYY-MM-DD).",
+    export.add_argument(
+        "--columns",
+        help="Comma-separated columns to export. Default: "
+        + ",".join(timetagger_cli.core.export_columns),
     )
-    show.add_argument(
-        "--end",
-        type=date_from_natural_language,
-        help="Start date in ISO-format (YYYY-MM-DD).",
+    export.add_argument("--output", "-o", help="File to write to. Default: stdout")
+
+    import_ = create_command_parser(
+        subparsers,
+        timetagger_cli.import_records,
+        "import",
+        description="The file needs the columns t1, t2 and ds, and optionally key. "
+        "Times can be Unix timestamps or ISO dates.",
+    )
+    import_.add_argument("file", help="File to import, or '-' to read from stdin.")
+    import_.add_argument(
+        "--format",
+        choices=["csv", "tsv", "jsonl"],
+        help="Input format. Default: based on the file extension, or csv",
+    )
+    import_.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="check the file, but don't import anything",
+    )
+
+    report = create_command_parser(subparsers, timetagger_cli.report)
+    add_time_range_arguments(report)
+    report.add_argument(
+        "--period",
+        choices=["day", "week", "month"],
+        help="Report per day, week or month. Default: the whole time frame",
+    )
+    report.add_argument(
+        "--by",
+        choices=["tag", "combination"],
+        default="tag",
+        help="Group by each tag, or by the combination of tags. Default: tag",
     )
 
     diagnose = create_command_parser(subparsers, timetagger_cli.diagnose)
     diagnose.add_argument("--fix", action="store_true", help="fix error records")
+    diagnose.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only check the records that changed since the last incremental run",
+    )
+    diagnose.add_argument(
+        "--overlaps",
+        action="store_true",
+        help="show the records that overlap (not in incremental runs)",
+    )
+    diagnose.add_argument(
+        "--fix-duplicates",
+        action="store_true",
+        help="remove duplicate records, keeping the first created one of each",
+    )
 
     start = create_command_parser(subparsers, timetagger_cli.start)
     start.add_argument("description", help="Description. Use '#' to create tags.")
@@ -91,6 +191,28 @@ def setup_parser():
     )
     add.add_argument("description", help="Description. Use '#' to create tags.")
 
+    create_command_parser(subparsers, timetagger_cli.sync)
+
+    create_command_parser(subparsers, timetagger_cli.daemon)
+
+    completion = create_command_parser(
+        subparsers,
+        timetagger_cli.completion,
+        description="Commands, tags and descriptions are completed. "
+        "E.g. add 'eval \"$(timetagger completion bash)\"' to your .bashrc.",
+    )
+    completion.add_argument(
+        "shell",
+        nargs="?",
+        choices=["bash", "zsh", "fish"],
+        help="the shell to print the script for",
+    )
+    completion.add_argument(
+        "--refresh",
+        action="store_true",
+        help="update the list of tags and descriptions to complete",
+    )
+
     resume = create_command_parser(subparsers, timetagger_cli.resume)
     resume.add_argument(
         "selected",
@@ -102,17 +224,85 @@ def setup_parser():
     return argparser
 
 
+def run_command(args, startup=None):
+    if args.timings or args.profile:
+        run_command_instrumented(args, startup)
+        return
+    # Push records that were saved locally before. Not for commands whose
+    # output is consumed by other programs (e.g. a shell), or that sync anyway.
+    no_flush = ("setup", "app", "sync", "daemon", "completion", "export")
+    if args.func.__name__ not in no_flush:
+        if journal.has_records():
+            timetagger_cli.core.flush_journal()
+    args.func(args)
+
+
+def run_command_instrumented(args, startup=None):
+    core = timetagger_cli.core
+    plain_args = argparse.Namespace(**vars(args) | {"timings": False, "profile": None})
+    t0 = time.perf_counter()
+    if args.timings:
+        timings.enable()
+        if startup is not None:
+            timings.add("startup", startup)
+        load_config = core.load_config
+        core.load_config = timings.timed("config", load_config)
+    try:
+        if args.profile:
+            import cProfile  # only needed when profiling
+
+            profiler = cProfile.Profile()
+            try:
+                profiler.runcall(run_command, plain_args)
+            finally:
+                profiler.dump_stats(args.profile)
+                print(
+                    f"Saved profile to {args.profile}, view with 'python -m pstats'",
+                    file=sys.stderr,
+                )
+        else:
+            run_command(plain_args)
+    finally:
+        if args.timings:
+            core.load_config = load_config
+            timings.report(time.perf_counter() - t0)
+            timings.disable()
+
+
 def main(argv=None):
     assert sys.version_info.major == 3, "This script needs to run with Python 3."
 
+    # Fast path for shell completion, without parsing the arguments
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["__complete"]:
+        shell_completion.complete(argv[1:])
+        return
+
     parser = setup_parser()
     args = parser.parse_args(argv)
     if hasattr(args, "func"):
         try:
-            args.func(args)
+            # Let the daemon run the command, if there is one. Not when the
+            # command is measured, because that must happen in this process.
+            forward = args.func.__name__ in resident.forwarded_commands
+            if forward and not (args.timings or args.profile):
+                result = resident.forward(list(argv))
+                if result is not None:
+                    sys.stdout.write(result["output"])
+                    sys.stderr.write(result["error"])
+                    if result["exit"]:
+                        sys.exit(result["exit"])
+                    return
+            run_command(args, time.perf_counter() - timings.t_start)
         except RuntimeError as err:
             msg = err.args[0] if err.args else "''"
             sys.exit(f"Timetagger runtime error: {msg}")
+        except BrokenPipeError:
+            # The output was piped into e.g. 'head', which stopped reading.
+            # Redirect the remaining output to devnull to exit quietly.
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, sys.stdout.fileno())
+            sys.exit(1)
     else:
         parser.print_help()
 
@@ -0,0 +1,31 @@
+"""
+The checkpoint of 'diagnose --incremental', so that subsequent runs only
+need to check the records that changed since the previous run (obtained
+via the incremental ``updates?since=`` endpoint). The checkpoint also
+holds the records that were flagged or running, because some checks
+depend on the current time, so these are checked again on each run.
+"""
+
+import os
+
+from .config import get_config_dir
+from .utils import read_state, write_private
+
+
+checkpoint_fname = "diagnose_checkpoint.json"
+
+
+def get_checkpoint_filename():
+    return os.path.join(get_config_dir(), checkpoint_fname)
+
+
+def load():
+    """Load the checkpoint. Its server_time is zero if there is none."""
+    default = {"version": 1, "server_time": 0, "records": {}}
+    return read_state(get_checkpoint_filename(), default)
+
+
+def save(server_time, records):
+    """Save the checkpoint, with the records (dicts) to check again."""
+    state = {"version": 1, "server_time": server_time, "records": records}
+    write_private(get_checkpoint_filename(), state)
@@ -1,9 +1,8 @@
 import os
 import sys
+import time
 
-import toml
-
-from .utils import user_config_dir
+from .utils import user_config_dir, read_state, write_private
 
 initial_config_text = """
 # This is the TimeTagger CLI configuration, in toml format.
@@ -24,6 +23,59 @@ api_token = ""
 # - ssl_verify = "path/to/certificate"
 # For more information, visit: https://letsencrypt.org/docs/certificates-for-localhost/
 ssl_verify = true
+
+# Keep a local copy of your records, synced incrementally with the server.
+# This makes commands like 'show' and 'diagnose' much faster on large accounts.
+# The first command after enabling this downloads all records once.
+use_local_store = false
+
+# Network settings: the timeouts (in seconds) for connecting to the server
+# and for waiting for its response, and the max number of pooled connections.
+connect_timeout = 10
+read_timeout = 60
+pool_size = 10
+
+# Failed requests (e.g. when the server is busy) are retried up to this many
+# times, waiting about retry_backoff seconds, doubling on each retry. All
+# requests of a single command give up after request_deadline seconds.
+max_retries = 3
+retry_backoff = 0.5
+request_deadline = 120
+
+# The max number of records to push to the server in a single request, and
+# the number of concurrent requests when importing many records.
+batch_size = 1000
+push_concurrency = 4
+
+# Long time ranges are fetched in chunks of this many days, using this
+# many concurrent requests.
+fetch_chunk_days = 31
+fetch_concurrency = 4
+
+# Cache the records of recently requested time ranges, which makes commands
+# that are run often (e.g. 'status' in a status bar) cheaper. After this many
+# seconds, the cache is checked for changes with a small request.
+response_cache = false
+response_cache_ttl = 10
+
+# Keep track of the running timers locally, so that 'start' and 'stop' don't
+# need to ask the server. Timers started or stopped by other clients (e.g. the
+# web app) are checked for with a small request after this many seconds.
+running_cache = false
+running_cache_ttl = 60
+
+# Whether time covered by overlapping records is counted once in totals
+# (e.g. when multiple timers were running at the same time).
+merge_overlaps = false
+
+# New records are saved locally first, and pushed later if the server cannot
+# be reached. Enable this to always push them in a background process, so
+# that commands like 'start' and 'stop' return immediately.
+background_sync = false
+
+# When running 'timetagger daemon', other commands are run by it, which is
+# faster. It pulls changed records from the server at this interval (seconds).
+daemon_sync_interval = 10
 """.lstrip().replace(
     "\r\n", "\n"
 )
@@ -34,12 +86,80 @@ if sys.platform.startswith("win"):
 
 config_fname = "config.txt"
 
+default_config = {
+    "ssl_verify": True,
+    "use_local_store": False,
+    "connect_timeout": 10,
+    "read_timeout": 60,
+    "pool_size": 10,
+    "max_retries": 3,
+    "retry_backoff": 0.5,
+    "request_deadline": 120,
+    "batch_size": 1000,
+    "push_concurrency": 4,
+    "fetch_chunk_days": 31,
+    "fetch_concurrency": 4,
+    "response_cache": False,
+    "response_cache_ttl": 10,
+    "running_cache": False,
+    "running_cache_ttl": 60,
+    "merge_overlaps": False,
+    "background_sync": False,
+    "daemon_sync_interval": 10,
+}
+
+
+cache_fname = "config_cache.json"
+
+# A file that was modified this recently (in seconds) may be modified
+# again without its mtime changing, so it's not cached yet.
+racy_interval = 2
+
+_config_dir = None
+_config_memo = None
+
+
+def get_config_dir():
+    """Get the directory of the config file (and other local files)."""
+    global _config_dir
+    if _config_dir is None:
+        _config_dir = user_config_dir("timetagger_cli")
+    return _config_dir
+
 
 def load_config():
-    """Load the config file and validate contents."""
-    filename = os.path.join(user_config_dir("timetagger_cli"), config_fname)
-    if not os.path.isfile(filename):
-        raise RuntimeError("Config not set, run 'timetagger setup' first.")
+    """Load the config file and validate contents.
+
+    The validated config is cached, in memory and in a small JSON file,
+    and reused for as long as the config file's mtime and size match.
+    """
+    global _config_memo
+
+    filename = os.path.join(get_config_dir(), config_fname)
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        raise RuntimeError("Config not set, run 'timetagger setup' first.") from None
+    key = [filename, stat.st_mtime_ns, stat.st_size]
+    cacheable = time.time() - stat.st_mtime > racy_interval
+
+    if cacheable and _config_memo and _config_memo[0] == key:
+        return default_config | _config_memo[1]
+
+    config = None
+    if cacheable:
+        config = _read_config_cache(key)
+    if config is None:
+        config = _parse_config(filename)
+        if cacheable:
+            _write_config_cache(key, config)
+    if cacheable:
+        _config_memo = key, config
+    return default_config | config
+
+
+def _parse_config(filename):
+    import toml
 
     with open(filename, "rb") as f:
         config = toml.loads(f.read().decode())
@@ -52,13 +172,37 @@ def load_config():
         )
     if "api_token" not in config:
         raise RuntimeError("No api_token set in config. Run 'timetagger setup' to fix.")
-    if "ssl_verify" not in config:
-        config |= {"ssl_verify": True}
     return config
 
 
+def _read_config_cache(key):
+    cache = read_state(os.path.join(get_config_dir(), cache_fname), {})
+    if cache.get("key") == key:
+        return cache.get("config")
+    return None
+
+
+def _write_config_cache(key, config):
+    filename = os.path.join(get_config_dir(), cache_fname)
+    try:
+        write_private(filename, {"key": key, "config": config})
+    except Exception:  # pragma: no cover
+        pass  # caching is an optimization
+
+
+def invalidate_config_cache():
+    """Clear the cached config, e.g. after the config file was edited."""
+    global _config_memo
+    _config_memo = None
+    try:
+        os.remove(os.path.join(get_config_dir(), cache_fname))
+    except OSError:
+        pass
+
+
 def prepare_config_file():
-    filename = os.path.join(user_config_dir("timetagger_cli"), config_fname)
+    filename = os.path.join(get_config_dir(), config_fname)
+    invalidate_config_cache()
 
     # If the config file is empty or does not exist, we write a default text
     try:
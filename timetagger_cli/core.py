@@ -1,24 +1,79 @@
+import sys
+import math
 import time
 import datetime
-import webbrowser
-
-import requests
+import itertools
+import collections
 
 from .utils import (
     generate_uid,
     total_time,
-    readable_time,
+    get_tags,
+    get_period_edges,
+    readable_period,
     readable_duration,
+    ReadableTimeFormatter,
     open_with_os_default,
+    run_detached,
+    get_resume_range,
+    select_resume_records,
+)
+from . import journal, timings, response_cache, running, jsonstream, checkpoint
+from .intervals import Intervals
+from .records import Record, RecordBatch, as_record
+from .config import (
+    prepare_config_file,
+    load_config,
+    default_config,
+    invalidate_config_cache,
 )
-from .config import prepare_config_file, load_config
 
 
 # %% lower level functions
 
 
-def request(method, path, body=None):
-    """Do an API request."""
+class ServerUnavailable(RuntimeError):
+    """Raised when the server cannot be reached, or has an internal error."""
+
+
+_session = None
+
+
+def get_session(config):
+    """Get the HTTP session that is shared by all API calls, so that
+    connections are pooled and kept alive.
+    """
+    global _session
+    if _session is None:
+        import requests  # slow to import, so only do it when needed
+
+        _session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=config["pool_size"], pool_maxsize=config["pool_size"]
+        )
+        _session.mount("http://", adapter)
+        _session.mount("https://", adapter)
+        _session.headers["Accept-Encoding"] = "gzip, deflate"
+    return _session
+
+
+_deadline = None
+
+
+def request(method, path, body=None, stream=False, retries=None, deadline=None):
+    """Do an API request.
+
+    Connection errors, timeouts and 429/5xx responses are retried with
+    jittered exponential backoff (or after the time given by Retry-After),
+    until max_retries (or the given number of retries) is reached, or the
+    request_deadline for all requests of the current command has passed.
+    A deadline (a time.monotonic() value) can also be given explicitly.
+
+    If stream is True, the response is not loaded at once. Instead, a
+    generator is returned that yields the records in the response as they
+    arrive, so that large responses need little memory.
+    """
+    global _deadline
     if body is not None:
         assert isinstance(body, (list, dict))
 
@@ -29,46 +84,399 @@ def request(method, path, body=None):
     if not token:
         raise RuntimeError("api_token not set, run 'timetagger setup' first.")
 
-    headers = {"authtoken": token}
-    response = requests.request(
-        method.upper(), url, json=body, headers=headers, verify=ssl_verify
-    )
+    import requests  # slow to import, so only do it when needed
+
+    if deadline is None:
+        if _deadline is None:
+            _deadline = time.monotonic() + config["request_deadline"]
+        deadline = _deadline
 
-    if response.status_code == 200:
-        return response.json()
+    session = get_session(config)
+    headers = {"authtoken": token}
+    # GET is idempotent, and so is PUT because records are keyed
+    if method.upper() not in ("GET", "PUT"):
+        retries = 0
+    elif retries is None:
+        retries = config["max_retries"]
+    for attempt in range(retries + 1):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise ServerUnavailable("The deadline for server requests has passed.")
+        timeout = (
+            min(config["connect_timeout"], remaining),
+            min(config["read_timeout"], remaining),
+        )
+        retry_after = None
+        if timings.enabled:
+            t0 = time.perf_counter()
+        try:
+            response = session.request(
+                method.upper(),
+                url,
+                json=body,
+                headers=headers,
+                verify=ssl_verify,
+                timeout=timeout,
+                stream=stream,
+            )
+        except (requests.ConnectionError, requests.Timeout) as err:
+            error = ServerUnavailable(f"Could not reach the server: {err}")
+        else:
+            if timings.enabled:
+                size = "streamed" if stream else f"{len(response.content)} bytes"
+                info = f"{method.upper()} {path} -> {response.status_code}, {size}"
+                timings.add("request", time.perf_counter() - t0, info)
+            if response.status_code == 200 and stream:
+                return _iter_streamed_records(response)
+            elif response.status_code == 200:
+                if timings.enabled:
+                    return timings.timed("decode", response.json)()
+                return response.json()
+            elif response.status_code == 429 or response.status_code >= 500:
+                error = ServerUnavailable(f"{response.status_code} - {response.text}")
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            else:
+                raise RuntimeError(f"{response.status_code} - {response.text}")
+        if attempt == retries:
+            break
+        if retry_after is None:
+            import random
+
+            retry_after = random.uniform(0, config["retry_backoff"] * 2**attempt)
+        if retry_after >= deadline - time.monotonic():
+            break
+        time.sleep(retry_after)
+    raise error
+
+
+def _iter_streamed_records(response):
+    import requests  # slow to import, so only do it when needed
+
+    try:
+        chunks = response.iter_content(chunk_size=2**16)
+        yield from jsonstream.iter_array(chunks, "records")
+    except requests.RequestException as err:
+        raise ServerUnavailable(f"Connection lost while receiving records: {err}")
+    except ValueError as err:
+        raise RuntimeError(f"Invalid response from the server: {err}")
+    finally:
+        response.close()
+
+
+def parse_retry_after(value):
+    """Parse the value of a Retry-After header into a number of seconds.
+    Returns None if the value is missing or invalid.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    import email.utils
+
+    try:
+        dt = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, dt.timestamp() - time.time())
+
+
+def put_records(records, retries=None):
+    """Push records to the server, in batches of the configured size.
+    Returns a dict with the keys of the accepted and failed records, the
+    keys of the records that could not be pushed at all (which are also
+    failed), and the error messages.
+    """
+    batch_size = max(1, load_config()["batch_size"])
+    result = {"accepted": [], "failed": [], "unpushed": [], "errors": []}
+    for i in range(0, len(records), batch_size):
+        batch_result = put_batch(records[i : i + batch_size], retries)
+        for name in result:
+            result[name] += batch_result[name]
+        if len(records) > batch_size:
+            print(f"Pushed {min(i + batch_size, len(records))}/{len(records)} records")
+    if result["accepted"]:
+        response_cache.invalidate()
+        accepted = set(result["accepted"])
+        running.update([r for r in records if r["key"] in accepted])
+    return result
+
+
+def put_batch(batch, retries=None, deadline=None):
+    """Push a batch of records in a single request. Returns a dict like
+    put_records() does.
+    """
+    result = {"accepted": [], "failed": [], "unpushed": [], "errors": []}
+    try:
+        ob = request("PUT", "records", batch, retries=retries, deadline=deadline)
+    except RuntimeError as err:
+        # Transient errors were already retried by request(), and other
+        # errors (e.g. a rejected request) would fail again.
+        result["failed"] += [r["key"] for r in batch]
+        result["unpushed"] += [r["key"] for r in batch]
+        result["errors"].append(str(err))
+    else:
+        result["accepted"] += ob.get("accepted", [r["key"] for r in batch])
+        result["failed"] += ob.get("failed", [])
+        result["errors"] += ob.get("errors", [])
+    return result
+
+
+def push_records(records):
+    """Push new or changed records to the server. The records are first
+    saved in the local journal, so that they are pushed later if the
+    server cannot be reached now.
+    """
+    journal.append_records(records)
+    if get_config_options()["background_sync"]:
+        run_detached([sys.executable, "-m", "timetagger_cli", "sync"])
+    elif _flush_failed:
+        print("The records are saved locally, and will be pushed later.")
     else:
-        raise RuntimeError(f"{response.status_code} - {response.text}")
+        # Don't keep the user waiting if the server does not respond right
+        # away; the records are safe in the journal and pushed later.
+        flush_journal(retries=0)
+
+
+_flush_failed = False
+
+
+def flush_journal(retries=None):
+    """Push the records in the local journal to the server, in one go.
+    Returns the number of records that remain queued.
+    """
+    global _flush_failed
+    records = journal.read_records()
+    if not records:
+        return 0
+    result = put_records(records, retries)
+    _flush_failed = bool(result["unpushed"])
+    unpushed = set(result["unpushed"])
+    journal.remove_records([r for r in records if r["key"] not in unpushed])
+    if result["failed"] and not unpushed:
+        print(f"The server rejected {len(result['failed'])} records:")
+        for error in result["errors"]:
+            print(f"  {error}")
+    if unpushed:
+        print(f"Could not push {len(unpushed)} records, they are saved locally.")
+        print(f"  {result['errors'][-1]}")
+        print("They will be pushed with the next command, or run 'timetagger sync'.")
+    return len(unpushed)
+
+
+def with_queued_records(records, t1=None, t2=None):
+    """Get the given records, updated with the records in the local
+    journal that have not been pushed yet (and overlap with t1-t2).
+    """
+    if not journal.has_records():
+        return records
+    queued = {r["key"]: r for r in journal.read_records()}
+    records = [queued.pop(r.get("key"), r) for r in records]
+    for r in queued.values():
+        if t1 is None or (r["t1"] <= t2 and (r["t2"] >= t1 or r["t1"] == r["t2"])):
+            records.append(r)
+    # Keep the records ordered by t1 (cheap, since they're mostly ordered)
+    records.sort(key=lambda r: r["t1"])
+    return records
+
+
+def get_time_range(args):
+    """Get the (start, end) datetimes from the --days, --start and --end
+    arguments of e.g. the show command.
+    """
+    if args.end:
+        end = datetime.datetime.combine(args.end, datetime.time.max).replace(
+            microsecond=0
+        )
+    else:
+        end = datetime.datetime.now()
+    if args.start:
+        start = datetime.datetime.combine(args.start, datetime.time.min)
+        if not args.end and args.days:
+            end = start + datetime.timedelta(days=args.days - 1)
+            end = end.replace(hour=23, minute=59, second=59, microsecond=0)
+    else:
+        days = 0
+        if args.days:
+            days = args.days - 1
+        start = end - datetime.timedelta(days=days)
+        start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    return start, end
 
 
-def print_records(records):
-    """Pretty-print a list of records."""
-    # Sort
-    records = sorted(records, key=lambda r: r["t1"])
+def print_records(records, ordered=False):
+    """Pretty-print records (dicts or Records). The records can be any
+    iterable, which is consumed as it is printed if ordered is True.
+    Otherwise the records are sorted by t1 first.
+    """
+    if ordered:
+        records = map(as_record, records)
+    else:
+        records = RecordBatch(records).sorted()
 
-    # Write header
-    print("Started".rjust(17), "Stopped".rjust(17), "Duration".rjust(9), " Description")
+    # Collect lines in blocks, and write these in one go
+    write = sys.stdout.write
+    split_time = ReadableTimeFormatter()
+    now = time.time()
+    lines = [f"{'Started':>17} {'Stopped':>17} {'Duration':>9}  Description\n"]
 
-    # Write each record
     for r in records:
-        started = readable_time(r["t1"])
-        if r["t1"] == r["t2"]:
+        t1, t2 = r.t1, r.t2
+        date1, time1 = split_time(t1)
+        started = f"{date1} {time1}"
+        if t1 == t2:
             stopped = "-"
-            duration = readable_duration(time.time() - r["t1"])
+            duration = readable_duration(now - t1)
+        else:
+            date2, time2 = split_time(t2)
+            stopped = time2 if date2 == date1 else f"{date2} {time2}"
+            duration = readable_duration(t2 - t1)
+        lines.append(f"{started:>17} {stopped:>17} {duration:>9}  {r.ds}\n")
+        if len(lines) >= 1000:
+            write("".join(lines))
+            lines.clear()
+
+    write("".join(lines))
+
+
+def get_config_options():
+    """Get the config, or the default config if it cannot be loaded. To
+    be used for options that should not stop a command from running;
+    request() will report the problem with the config.
+    """
+    try:
+        return load_config()
+    except RuntimeError:
+        return default_config
+
+
+_store = None
+
+
+def get_store():
+    """Get the local record store, synced with the server. Returns None
+    if the local store is not enabled.
+    """
+    global _store
+    if _store is None:
+        if not get_config_options()["use_local_store"]:
+            return None
+        from .store import RecordStore
+
+        _store = RecordStore()
+        _store.sync(request)
+    return _store
+
+
+def get_records(t1, t2):
+    """Get the records that overlap with the given time range."""
+    return with_queued_records(list(iter_records(t1, t2)), t1, t2)
+
+
+def iter_records(t1, t2):
+    """Iterate over the records that overlap with the given time range,
+    ordered by t1. Long ranges are fetched in chunks, concurrently, and
+    records are yielded as soon as their chunk has arrived.
+    """
+    store = get_store()
+    if store is not None:
+        yield from store.get_records(t1, t2)
+        return
+
+    config = get_config_options()
+    chunk_size = max(1, config["fetch_chunk_days"]) * 86400
+    chunks = [(t, min(t + chunk_size, t2)) for t in range(t1, t2, chunk_size)]
+    chunks = chunks or [(t1, t2)]
+    if len(chunks) == 1:
+        if config["response_cache"]:
+            ttl = config["response_cache_ttl"]
+            records = response_cache.get_records(request, t1, t2, ttl)
         else:
-            stopped = readable_time(r["t2"])
-            duration = readable_duration(r["t2"] - r["t1"])
-            if stopped.split(" ")[0] == started.split(" ")[0]:
-                stopped = stopped.split(" ", 1)[1]
-        description = " " + r.get("ds", "")
-        print(started.rjust(17), stopped.rjust(17), duration.rjust(9), description)
+            records = request("GET", f"records?timerange={t1}-{t2}")["records"]
+        yield from sorted(records, key=lambda r: r["t1"])
+        return
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    def fetch(chunk):
+        return request("GET", f"records?timerange={chunk[0]}-{chunk[1]}")
+
+    # Keep a limited number of chunks in flight, to bound memory use.
+    # Records that cross a chunk boundary are returned for both chunks;
+    # they are yielded with the first, which keeps the t1 order intact.
+    concurrency = max(1, config["fetch_concurrency"])
+    chunks = iter(chunks)
+    seen = set()
+    with ThreadPoolExecutor(concurrency) as executor:
+        pending = collections.deque()
+        for chunk in itertools.islice(chunks, concurrency):
+            pending.append((chunk[1], executor.submit(fetch, chunk)))
+        while pending:
+            chunk_t2, future = pending.popleft()
+            for chunk in itertools.islice(chunks, 1):
+                pending.append((chunk[1], executor.submit(fetch, chunk)))
+            crossing = set()
+            for r in sorted(future.result()["records"], key=lambda r: r["t1"]):
+                if r["t2"] >= chunk_t2 or r["t1"] == r["t2"]:
+                    crossing.add(r["key"])
+                if r["key"] not in seen:
+                    yield r
+            seen = crossing
+
+
+def iter_tagged_intervals(t1, t2):
+    """Iterate over (t1, t2, tags) tuples for the non-hidden records that
+    overlap with the given time range.
+    """
+    store = get_store()
+    if store is not None:
+        yield from store.get_tagged_intervals(t1, t2)
+        return
+    for r in iter_records(t1, t2):
+        ds = r.get("ds", "")
+        if not ds.startswith("HIDDEN"):
+            yield r["t1"], r["t2"], get_tags(ds)
+
+
+def get_all_records():
+    """Get all records of this user."""
+    store = get_store()
+    if store is not None:
+        return store.get_all_records()
+    return request("GET", "updates?since=0")["records"]
+
+
+def iter_all_records():
+    """Iterate over all records of this user. The records are streamed
+    from the server, so they are not all held in memory at once.
+    """
+    store = get_store()
+    if store is not None:
+        return iter(store.get_all_records())
+    return request("GET", "updates?since=0", stream=True)
 
 
 def get_running_records():
-    now = int(time.time())
-    t1 = now - 35 * 60
-    t2 = now + 60
-    ob = request("GET", f"records?timerange={t1}-{t2}")
-    return [r for r in ob["records"] if r["t1"] == r["t2"]]
+    global _flush_failed
+    config = get_config_options()
+    try:
+        store = get_store()
+        if store is not None:
+            records = with_queued_records(store.get_running_records())
+        elif config["running_cache"]:
+            ttl = config["running_cache_ttl"]
+            records = running.get_running_records(request, ttl)
+            records = with_queued_records(records)
+        else:
+            now = int(time.time())
+            records = get_records(now - 35 * 60, now + 60)
+    except ServerUnavailable as err:
+        # Don't try to push the new records too, they are saved locally
+        _flush_failed = True
+        print(f"Could not get the running records from the server. {err}")
+        records = with_queued_records([])
+    return [r for r in records if r["t1"] == r["t2"]]
 
 
 # %% The commands
@@ -76,6 +484,8 @@ def get_running_records():
 
 def app(args):
     """Open the TimeTagger app in your default browser."""
+    import webbrowser
+
     config = load_config()
     parts = config["api_url"].rstrip("/").split("/")
     url = "/".join(parts[:-2]) + "/app/"
@@ -89,6 +499,7 @@ def setup(args=None):
     print("Config file: " + filename)
     print("Will now (try to) open the config file. Just edit and save the file.")
     open_with_os_default(filename)
+    invalidate_config_cache()
 
 
 # Alternative to setup() ...
@@ -133,7 +544,7 @@ def start(args):
 
     # Push
     records = running_records + [r]
-    request("PUT", "records", records)
+    push_records(records)
 
     # Report
     if not running_records:
@@ -167,7 +578,7 @@ def add(args):
     }
 
     # Push
-    request("PUT", "records", [r])
+    push_records([r])
 
     print()
     print_records([r])
@@ -187,7 +598,7 @@ def stop(args=None):
         print("No running records.")
     else:
         print("Stopping running records.")
-        request("PUT", "records", running_records)
+        push_records(running_records)
         print()
         print_records(running_records)
 
@@ -197,32 +608,15 @@ def resume(args):
     selected = args.selected
 
     now = int(time.time())
-    d = datetime.datetime.fromtimestamp(now)
 
-    today = datetime.datetime(d.year, d.month, d.day)
-    tomorrow = today + datetime.timedelta(days=1)
-    last_week = today - datetime.timedelta(days=7)
-
-    t1 = int(last_week.timestamp())
-    t2 = int(tomorrow.timestamp())
-
-    # Get records from the last week
-    records = request("GET", f"records?timerange={t1}-{t2}")["records"]
-
-    # Remove HIDDEN records
-    filtered_records = [r for r in records if "HIDDEN" not in r["ds"]]
+    # Get the last 10 records from the last week (except HIDDEN records)
+    t1, t2 = get_resume_range(now)
+    filtered_records = select_resume_records(get_records(t1, t2))
 
     if len(filtered_records) == 0:
         print("No records within the last week.")
         return
 
-    # Sort records by time
-    filtered_records.sort(key=lambda r: r["t2"])
-
-    # Get last 10 records
-    if len(filtered_records) > 10:
-        filtered_records = filtered_records[-10:]
-
     if selected is None:
         print("Which record would you like to resume? [1]")
         for i in range(len(filtered_records)):
@@ -264,7 +658,7 @@ def resume(args):
 
     # Push
     records = running_records + [r]
-    request("PUT", "records", records)
+    push_records(records)
 
     # Report
     if not running_records:
@@ -295,20 +689,14 @@ def status(args=None):
     t_day2 = int(tomorrow.timestamp())
 
     # Collect records
-    ob = request("GET", f"records?timerange={t_week1}-{t_week2}")
-    week_records = [
-        r for r in ob["records"] if not r.get("ds", "").startswith("HIDDEN")
-    ]
-    day_records = [
-        r
-        for r in week_records
-        if r["t1"] < t_day2 and (r["t1"] == r["t2"] or r["t2"] > t_day1)
-    ]
-    running_records = [r for r in week_records if r["t1"] == r["t2"]]
+    week_records = RecordBatch(get_records(t_week1, t_week2)).visible()
+    day_records = week_records.overlapping(t_day1, t_day2)
+    running_records = week_records.running()
 
     # Calculate totals
-    total_week = total_time(week_records, last_monday, next_monday)
-    total_day = total_time(day_records, today, tomorrow)
+    merge = get_config_options()["merge_overlaps"]
+    total_week = total_time(week_records, last_monday, next_monday, merge)
+    total_day = total_time(day_records, today, tomorrow, merge)
 
     # Report
     print()
@@ -318,8 +706,7 @@ def status(args=None):
         print("Running: N/A")
     elif len(running_records) == 1:
         r = running_records[0]
-        duration = now - running_records[0]["t1"]
-        print(f"Running: {readable_duration(duration)} - {r.get('ds')}")
+        print(f"Running: {readable_duration(now - r.t1)} - {r.ds}")
     else:
         print(f"There are {len(running_records)} running timers.")
     print()
@@ -329,30 +716,13 @@ def status(args=None):
 
 def show(args):
     """List records of the requested time frame."""
-    if args.end:
-        end = datetime.datetime.combine(args.end, datetime.time.max).replace(
-            microsecond=0
-        )
-    else:
-        end = datetime.datetime.now()
-    if args.start:
-        start = datetime.datetime.combine(args.start, datetime.time.min)
-        if not args.end and args.days:
-            end = start + datetime.timedelta(days=args.days - 1)
-            end = end.replace(hour=23, minute=59, second=59, microsecond=0)
-    else:
-        days = 0
-        if args.days:
-            days = args.days - 1
-        start = end - datetime.timedelta(days=days)
-        start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    start, end = get_time_range(args)
 
     # Collect records
-    ob = request(
-        "GET", f"records?timerange={int(start.timestamp())}-{int(end.timestamp())}"
-    )
-    records = [r for r in ob["records"] if not r.get("ds", "").startswith("HIDDEN")]
-    total = total_time(records, start, end)
+    records = get_records(int(start.timestamp()), int(end.timestamp()))
+    records = RecordBatch(records).visible()
+    merge = get_config_options()["merge_overlaps"]
+    total = total_time(records, start, end, merge)
     days = (end - start).days + 1
     print(f"Start:       {start}")
     print(f"End:         {end}")
@@ -361,52 +731,401 @@ def show(args):
     print()
 
     print("Records:")
-    print_records(records)
+    print_records(records, ordered=True)
+
+
+export_columns = ["key", "t1", "t2", "duration", "tags", "ds"]
+
+
+def export(args):
+    """Export records of the requested time frame as CSV, TSV or JSON Lines."""
+    import csv
+    import json
+
+    columns = args.columns.split(",") if args.columns else export_columns
+    for column in columns:
+        if column not in export_columns:
+            raise RuntimeError(
+                f"Invalid column '{column}', choose from {','.join(export_columns)}."
+            )
+
+    start, end = get_time_range(args)
+    records = iter_records(int(start.timestamp()), int(end.timestamp()))
+
+    def iter_rows():
+        now = time.time()
+        for r in records:
+            ds = r.get("ds", "")
+            if ds.startswith("HIDDEN"):
+                continue
+            values = {
+                "key": r["key"],
+                "t1": r["t1"],
+                "t2": r["t2"],
+                "duration": (now if r["t1"] == r["t2"] else r["t2"]) - r["t1"],
+                "tags": " ".join(get_tags(ds)),
+                "ds": ds,
+            }
+            yield [values[column] for column in columns]
+
+    f = sys.stdout
+    if args.output:
+        f = open(args.output, "w", newline="", encoding="utf-8")
+    try:
+        # Write each row as it comes in, the file object does the buffering
+        if args.format == "jsonl":
+            for row in iter_rows():
+                f.write(json.dumps(dict(zip(columns, row))) + "\n")
+        else:
+            delimiter = "\t" if args.format == "tsv" else ","
+            writer = csv.writer(f, delimiter=delimiter, lineterminator="\n")
+            writer.writerow(columns)
+            writer.writerows(iter_rows())
+    finally:
+        if args.output:
+            f.close()
+
+
+def import_records(args):
+    """Import records from a CSV, TSV or JSON Lines file, e.g. made with 'export'."""
+    import csv
+    import json
+    from concurrent.futures import ThreadPoolExecutor
+
+    fmt = args.format
+    if fmt is None:
+        fmt = "tsv" if args.file.endswith(".tsv") else "csv"
+        fmt = "jsonl" if args.file.endswith((".jsonl", ".json")) else fmt
+
+    # Get the existing records, to skip the ones that were already imported
+    existing_keys = set()
+    existing_records = set()
+    if not args.dry_run:
+        for r in iter_all_records():
+            existing_keys.add(r["key"])
+            existing_records.add((r["t1"], r["t2"], r.get("ds", "")))
+
+    counts = {"read": 0, "duplicate": 0, "invalid": 0}
+    invalid_messages = []
+
+    def iter_records_from_rows(rows):
+        now = time.time()
+        for i, row in enumerate(rows, 1):
+            counts["read"] += 1
+            try:
+                if fmt == "jsonl":
+                    row = json.loads(row)
+                r = record_from_row(row, now)
+            except (ValueError, TypeError, AttributeError) as err:
+                counts["invalid"] += 1
+                invalid_messages.append(f"Row {i}: {err}")
+                continue
+            fingerprint = r["t1"], r["t2"], r["ds"]
+            if r["key"] in existing_keys or fingerprint in existing_records:
+                counts["duplicate"] += 1
+                continue
+            existing_keys.add(r["key"])
+            existing_records.add(fingerprint)
+            yield r
+
+    def iter_batches(records):
+        batch = []
+        for r in records:
+            batch.append(r)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    config = load_config()
+    batch_size = max(1, config["batch_size"])
+    concurrency = max(1, config["push_concurrency"])
+    result = {"accepted": [], "failed": [], "unpushed": [], "errors": []}
+
+    f = sys.stdin if args.file == "-" else open(args.file, newline="", encoding="utf-8")
+    try:
+        if fmt == "jsonl":
+            rows = (line for line in f if line.strip())
+        else:
+            rows = csv.DictReader(f, delimiter="\t" if fmt == "tsv" else ",")
+        batches = iter_batches(iter_records_from_rows(rows))
+        if args.dry_run:
+            for batch in batches:
+                result["accepted"] += [r["key"] for r in batch]
+        else:
+            # Keep a limited number of batches in flight, so that the file
+            # is not read much faster than the records can be pushed.
+            def collect(batch, future):
+                batch_result = future.result()
+                for name in result:
+                    result[name] += batch_result[name]
+                accepted = set(batch_result["accepted"])
+                running.update([r for r in batch if r["key"] in accepted])
+                print(f"Imported {len(result['accepted'])} records")
+
+            with ThreadPoolExecutor(concurrency) as executor:
+                pending = collections.deque()
+                for batch in batches:
+                    if len(pending) >= concurrency:
+                        collect(*pending.popleft())
+                    # A large import takes longer than the request_deadline,
+                    # so the deadline applies to each batch instead.
+                    deadline = time.monotonic() + config["request_deadline"]
+                    future = executor.submit(put_batch, batch, None, deadline)
+                    pending.append((batch, future))
+                while pending:
+                    collect(*pending.popleft())
+            if result["accepted"]:
+                response_cache.invalidate()
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+    # Report
+    verb = "Would import" if args.dry_run else "Imported"
+    print(f"Read {counts['read']} rows. {verb} {len(result['accepted'])} records.")
+    if counts["duplicate"]:
+        print(f"Skipped {counts['duplicate']} records that already exist.")
+    if invalid_messages:
+        print(f"Skipped {counts['invalid']} invalid rows:")
+        for message in invalid_messages[:10]:
+            print(f"  {message}")
+    if result["failed"]:
+        print(f"The server did not accept {len(result['failed'])} records:")
+        for error in result["errors"][:10]:
+            print(f"  {error}")
+
+
+def record_from_row(row, now):
+    """Create a record from a row of an imported file (a dict). Raises
+    ValueError if the row is invalid.
+    """
+
+    def get_time(name):
+        value = row.get(name)
+        if value is None or value == "":
+            raise ValueError(f"missing {name}")
+        try:
+            t = float(value)
+        except ValueError:
+            return datetime.datetime.fromisoformat(value).timestamp()
+        if not math.isfinite(t):
+            raise ValueError(f"{name} is not a finite number")
+        return t
+
+    t1, t2 = get_time("t1"), get_time("t2")
+    if t1 > t2:
+        raise ValueError("t1 is larger than t2")
+    return {
+        "key": str(row.get("key") or generate_uid()),
+        "t1": int(t1) if t1.is_integer() else t1,
+        "t2": int(t2) if t2.is_integer() else t2,
+        "mt": now,
+        "st": 0,
+        "ds": str(row.get("ds") or ""),
+    }
+
+
+def report(args):
+    """Report the time spent per tag, optionally per day, week or month."""
+    start, end = get_time_range(args)
+    edges = [start, end]
+    if args.period:
+        edges = get_period_edges(start, end, args.period)
+    stamps = [edge.timestamp() for edge in edges]
+
+    # Collect the intervals per group. The group None is used for the total.
+    intervals = collections.defaultdict(Intervals)
+    now = time.time()
+    for t1, t2, tags in iter_tagged_intervals(int(stamps[0]), int(stamps[-1])):
+        if t1 == t2:
+            t2 = now
+        if args.by == "combination":
+            groups = [" ".join(sorted(tags))] if tags else []
+        else:
+            groups = tags
+        for group in [None, *(groups or ["(untagged)"])]:
+            intervals[group].append(t1, t2)
+    if get_config_options()["merge_overlaps"]:
+        intervals = {group: x.union() for group, x in intervals.items()}
+
+    # Sum the durations in each period
+    totals = {group: x.histogram(stamps) for group, x in intervals.items()}
+    totals.setdefault(None, [0] * (len(stamps) - 1))
+
+    # Report
+    print(f"Start:       {start}")
+    print(f"End:         {end}")
+    print()
+    group_title = "Tags" if args.by == "combination" else "Tag"
+    if args.period:
+        print(f"{'Period':<10} {'Duration':>9}  {group_title}")
+    else:
+        print(f"{'Duration':>9}  {group_title}")
+    for i in range(len(stamps) - 1):
+        label = readable_period(edges[i], args.period) if args.period else None
+        rows = [(-t[i], group) for group, t in totals.items() if group and t[i]]
+        rows.sort()
+        rows.insert(0, (-totals[None][i], "total"))
+        for neg_duration, group in rows:
+            duration = readable_duration(-neg_duration)
+            if label is None:
+                print(f"{duration:>9}  {group}")
+            else:
+                print(f"{label:<10} {duration:>9}  {group}")
+                label = ""
+
+
+def sync(args=None):
+    """Push locally saved records to the server, and update the local store."""
+    if flush_journal() == 0:
+        print("All records are pushed.")
+    if get_store() is not None:
+        print("The local store is up to date.")
+
+
+def completion(args):
+    """Print a script that enables shell completion."""
+    from .shell_completion import scripts, refresh_index, index_days
+
+    if args.refresh:
+        # Index all records if there is a local store, otherwise the recent ones
+        store = get_store()
+        if store is not None:
+            records = store.get_all_records()
+        else:
+            t2 = int(time.time()) + 86400
+            records = get_records(t2 - index_days * 86400, t2)
+        index = refresh_index(records)
+        print(
+            f"Indexed {len(index['tags'])} tags and {len(index['descriptions'])} descriptions."
+        )
+    elif args.shell:
+        print(scripts[args.shell].strip())
+    else:
+        raise RuntimeError("Specify the shell: bash, zsh or fish.")
+
+
+def daemon(args=None):
+    """Keep running, so that other commands are faster (experimental)."""
+    from .resident import Daemon
+
+    server = Daemon(sync_interval=get_config_options()["daemon_sync_interval"])
+    print(f"Serving commands at {server.path}, press Ctrl-C to stop.")
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        print("Stopped.")
+
+
+# Records with the same description, and start and end times that differ
+# at most this many seconds, are considered duplicates by diagnose.
+duplicate_tolerance = 60
 
 
 def diagnose(args):
-    """Load all records and perform diagnostics to detect errors. Use '--fix' to fix errors."""
+    """Load all records and perform diagnostics to detect errors. Use '--fix' to fix errors, and '--incremental' to only check what changed since the last run."""
 
     def show_record(prefix, r):
-        dt1 = datetime.datetime.fromtimestamp(r["t1"])
-        dt2 = datetime.datetime.fromtimestamp(r["t2"])
-        print(f"{prefix}: {r['key']}, from {dt1} to {dt2}")
-
-    # Get records and sort by t1
-    ob = request("GET", f"updates?since=0")
-    records = ob["records"]
-    records = sorted(records, key=lambda r: r["t1"])
+        dt1 = datetime.datetime.fromtimestamp(r.t1)
+        dt2 = datetime.datetime.fromtimestamp(r.t2)
+        print(f"{prefix}: {r.key}, from {dt1} to {dt2}")
+
+    # Get the records to check. With --incremental, only the records that
+    # changed since the previous run are fetched. The records that were
+    # flagged or running then are checked again, since some of the checks
+    # depend on the current time. With a local store, all records are local
+    # anyway, so they are simply all checked.
+    incremental = args.incremental and get_store() is None
+    ob = None
+    if incremental:
+        state = checkpoint.load()
+        if state["server_time"]:
+            ob = request("GET", f"updates?since={state['server_time']}")
+            if ob.get("reset"):
+                ob = None
+    if ob is not None:
+        server_time = ob["server_time"]
+        changed = {r["key"] for r in ob["records"]}
+        held = [r for r in state["records"].values() if r["key"] not in changed]
+        records = ob["records"] + held
+        print(f"Checking {len(changed)} records that changed since the last run")
+    else:
+        if incremental:
+            # Get the server time first, so no change is missed next time
+            server_time = request("GET", f"updates?since={time.time()}")["server_time"]
+        records = iter_all_records()
 
     # Prep
-    early_date = datetime.datetime(2000, 1, 1)
-    late_date = datetime.datetime.now() + datetime.timedelta(days=1)
-    very_late_date = datetime.datetime.now() + datetime.timedelta(days=365 * 2)
+    now = time.time()
+    early_time = datetime.datetime(2000, 1, 1).timestamp()
+    late_time = now + 86400
+    very_late_time = now + 86400 * 365 * 2
 
-    # Investigate records
+    # Investigate the records as they stream in. Only the flagged records
+    # are kept, as Record objects.
     suspicious_records = []
     wrong_records = []
-    for r in records:
-        t1, t2 = r["t1"], r["t2"]
+    keep = {} if incremental else None
+    visible = None if incremental else []  # for the duplicates and overlaps
+    count = 0
+    for d in records:
+        count += 1
+        t1, t2 = d["t1"], d["t2"]
         if t1 < 0 or t2 < 0:
-            wrong_records.append(("negative timestamp", r))
+            found = wrong_records, "negative timestamp"
         elif t1 > t2:
-            wrong_records.append(("t1 larger than t2", r))
-        elif datetime.datetime.fromtimestamp(r["t2"]) > very_late_date:
-            wrong_records.append(("far future", r))
-        elif datetime.datetime.fromtimestamp(r["t1"]) < early_date:
-            suspicious_records.append(("early", r))
-        elif datetime.datetime.fromtimestamp(r["t2"]) > late_date:
-            suspicious_records.append(("future", r))
+            found = wrong_records, "t1 larger than t2"
+        elif t2 > very_late_time:
+            found = wrong_records, "far future"
+        elif t1 < early_time:
+            found = suspicious_records, "early"
+        elif t2 > late_time:
+            found = suspicious_records, "future"
         elif t2 - t1 > 86400 * 2:
-            suspicious_records.append(("duration over two days", r))
-        elif t1 == t2 and abs(time.time() - t1) > 86400 * 2:
-            ndays = round(abs(time.time() - t1) / 86400)
-            suspicious_records.append((f"running for about {ndays} days", r))
-
-    suspicious_records.sort()
-    wrong_records.sort()
-
-    print(f"Checked {len(records)} records")
+            found = suspicious_records, "duration over two days"
+        elif t1 == t2 and abs(now - t1) > 86400 * 2:
+            ndays = round(abs(now - t1) / 86400)
+            found = suspicious_records, f"running for about {ndays} days"
+        else:
+            found = None
+        r = None
+        if found:
+            r = Record.from_dict(d)
+            found[0].append((found[1], r))
+        if keep is not None and (found or t1 == t2):
+            keep[d["key"]] = d
+        if visible is not None and 0 <= t1 <= t2:
+            r = r or Record.from_dict(d)
+            if not r.hidden:
+                visible.append(r)
+
+    # Find duplicates (e.g. from importing twice) and overlapping records.
+    # This needs all records, so it's not done in incremental runs.
+    duplicate_groups = []
+    overlaps = []
+    if visible is not None:
+        batch = RecordBatch(visible)
+        duplicate_groups = batch.duplicates(duplicate_tolerance)
+        group_ids = {}
+        for i, group in enumerate(duplicate_groups):
+            group_ids.update((r.key, i) for r in group)
+        overlaps = [
+            (r1, r2)
+            for r1, r2 in batch.overlaps()
+            if group_ids.get(r1.key, -1) != group_ids.get(r2.key, -2)
+        ]
+        del visible, batch
+
+    if incremental:
+        checkpoint.save(server_time, keep)
+
+    # Sort by prefix, and by t1 within the same prefix
+    suspicious_records.sort(key=lambda x: (x[0], x[1].t1))
+    wrong_records.sort(key=lambda x: (x[0], x[1].t1))
+
+    print(f"Checked {count} records")
 
     # Show records
     if wrong_records:
@@ -417,21 +1136,62 @@ def diagnose(args):
         print("Suspicious records:")
         for prefix, r in suspicious_records:
             show_record(prefix + ":", r)
-
-    if not wrong_records and not suspicious_records:
+    if duplicate_groups:
+        print("Duplicate records:")
+        for group in duplicate_groups:
+            # Keep the record that was created first
+            original = min(group, key=lambda r: (r.mt, r.key))
+            x = original.t1, original.t2, original.ds
+            for r in group:
+                if r is not original:
+                    kind = "exact" if (r.t1, r.t2, r.ds) == x else "near"
+                    show_record(f"{kind} duplicate of {original.key}", r)
+    if overlaps and args.overlaps:
+        print("Overlapping records:")
+        for r1, r2 in overlaps:
+            show_record(f"overlaps with {r1.key}", r2)
+    elif overlaps:
+        print(f"Found {len(overlaps)} pairs of overlapping records (see '--overlaps')")
+
+    if not (wrong_records or suspicious_records or duplicate_groups or overlaps):
         print("All looks good")
 
+    def print_failed(result):
+        if result["failed"]:
+            print(f"Failed to update {len(result['failed'])} records:")
+            for key in result["failed"]:
+                print(f"  {key}")
+            for error in result["errors"]:
+                print(f"  {error}")
+
     # Fixing wrong records
-    if args.fix:
+    if args.fix and wrong_records:
+        records_to_push = []
         for prefix, r in wrong_records:
-            if "t1 larger than t2 " in prefix:
-                r["t1"], r["t2"] = r["t2"], r["t1"]
-                request("PUT", "records", [r])
+            if prefix == "t1 larger than t2":
+                r.t1, r.t2 = r.t2, r.t1
             else:
-                dt = abs(r["t1"] - r["t2"])
+                dt = abs(r.t1 - r.t2)
                 if dt > 86400 * 1.2:
                     dt = 3600
-                r["t1"] = int(time.time())
-                r["t2"] = r["t1"] + dt
-                request("PUT", "records", [r])
-            print(f"Updated {r['key']}")
+                r.t1 = int(time.time())
+                r.t2 = r.t1 + dt
+            r.mt = time.time()
+            records_to_push.append(r.to_dict())
+        result = put_records(records_to_push)
+        print(f"Updated {len(result['accepted'])} records")
+        print_failed(result)
+
+    # Fixing duplicates, by hiding (i.e. deleting) all but the original
+    if args.fix_duplicates and duplicate_groups:
+        records_to_push = []
+        for group in duplicate_groups:
+            original = min(group, key=lambda r: (r.mt, r.key))
+            for r in group:
+                if r is not original:
+                    r.ds = "HIDDEN " + r.ds
+                    r.mt = time.time()
+                    records_to_push.append(r.to_dict())
+        result = put_records(records_to_push)
+        print(f"Removed {len(result['accepted'])} duplicate records")
+        print_failed(result)
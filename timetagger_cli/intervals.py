@@ -0,0 +1,98 @@
+"""
+Array-backed interval arithmetic, to sum the durations of many records.
+"""
+
+import bisect
+import operator
+from array import array
+from itertools import repeat, compress
+
+
+class Intervals:
+    """A batch of time intervals, stored as parallel arrays of start
+    and end times. The operations are done on whole arrays, using
+    builtins that loop in C where possible.
+    """
+
+    def __init__(self, t1=(), t2=()):
+        self.t1 = array("d", t1)
+        self.t2 = array("d", t2)
+        if len(self.t1) != len(self.t2):
+            raise ValueError("t1 and t2 must have the same length")
+
+    @classmethod
+    def from_records(cls, records, now):
+        """Create from a list of records. Running records end at now."""
+        t1 = [r["t1"] for r in records]
+        t2 = [now if r["t1"] == r["t2"] else r["t2"] for r in records]
+        return cls(t1, t2)
+
+    def __len__(self):
+        return len(self.t1)
+
+    def append(self, t1, t2):
+        """Add an interval."""
+        self.t1.append(t1)
+        self.t2.append(t2)
+
+    def durations(self, start, end):
+        """Get the durations of the intervals, clipped to the given range."""
+        t1 = map(max, self.t1, repeat(start))
+        t2 = map(min, self.t2, repeat(end))
+        return map(max, map(operator.sub, t2, t1), repeat(0.0))
+
+    def total(self, start, end):
+        """Get the summed duration, clipped to the given range."""
+        durations = array("d", map(operator.sub, self.t2, self.t1))
+        total = sum(durations)
+        # Correct for the (typically few) intervals that stick out of the
+        # range, or that have a negative duration.
+        outside = map(
+            operator.or_,
+            map(operator.lt, self.t1, repeat(start)),
+            map(operator.gt, self.t2, repeat(end)),
+        )
+        if durations and min(durations) < 0:
+            outside = map(operator.or_, outside, map(operator.lt, durations, repeat(0)))
+        for t1, t2 in compress(zip(self.t1, self.t2), outside):
+            total += max(0.0, min(t2, end) - max(t1, start)) - (t2 - t1)
+        return total
+
+    def union(self):
+        """Get the union of the intervals, i.e. with overlapping intervals
+        merged, sorted by start time.
+        """
+        result = Intervals()
+        order = sorted(range(len(self.t1)), key=self.t1.__getitem__)
+        cur1 = cur2 = None
+        for i in order:
+            t1, t2 = self.t1[i], self.t2[i]
+            if cur2 is not None and t1 <= cur2:
+                cur2 = max(cur2, t2)
+            else:
+                if cur2 is not None:
+                    result.append(cur1, cur2)
+                cur1, cur2 = t1, t2
+        if cur2 is not None:
+            result.append(cur1, cur2)
+        return result
+
+    def histogram(self, edges):
+        """Get the summed duration in each bucket between the given
+        (sorted) edges. Intervals are clipped to the buckets.
+        """
+        n = len(edges) - 1
+        totals = [0.0] * n
+        # Look up the first and last bucket of each interval at once
+        i1s = map(bisect.bisect_right, repeat(edges), self.t1)
+        i2s = map(bisect.bisect_left, repeat(edges), self.t2)
+        for t1, t2, i1, i2 in zip(self.t1, self.t2, i1s, i2s):
+            if i1 == i2 and 0 < i1 <= n:
+                # The common case: the interval is inside a single bucket
+                totals[i1 - 1] += max(0.0, t2 - t1)
+                continue
+            for i in range(max(0, i1 - 1), min(n, i2)):
+                duration = min(t2, edges[i + 1]) - max(t1, edges[i])
+                if duration > 0:
+                    totals[i] += duration
+        return totals
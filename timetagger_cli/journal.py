@@ -0,0 +1,114 @@
+"""
+A durable local journal of records that are yet to be pushed to the
+server, so that writes are not lost when the server cannot be reached.
+"""
+
+import os
+import sys
+import json
+import contextlib
+
+from .config import get_config_dir
+
+
+journal_fname = "journal.jsonl"
+
+
+def get_journal_filename():
+    return os.path.join(get_config_dir(), journal_fname)
+
+
+def has_records():
+    """Get whether there are records in the journal (cheap to call)."""
+    try:
+        return os.path.getsize(get_journal_filename()) > 0
+    except OSError:
+        return False
+
+
+def _open(filename, mode):
+    # The journal contains the user's records, so only the user may read it
+    flags = os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0)
+    flags |= os.O_APPEND if mode.startswith("a") else os.O_TRUNC
+    return os.fdopen(os.open(filename, flags, 0o600), mode)
+
+
+@contextlib.contextmanager
+def locked():
+    """Context manager to hold an exclusive lock on the journal, so that
+    other processes cannot change it in the meantime.
+    """
+    with open(get_journal_filename() + ".lock", "a+b") as f:
+        if sys.platform.startswith("win"):
+            import msvcrt
+
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def append_records(records):
+    """Append records to the journal, and make sure they're on disk."""
+    text = "".join(json.dumps(r) + "\n" for r in records)
+    with locked(), _open(get_journal_filename(), "a+b") as f:
+        # Make sure not to continue a line that was not completely written
+        if f.seek(0, os.SEEK_END) > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                text = "\n" + text
+        f.write(text.encode())
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_records():
+    """Get the records in the journal. Records with the same key are
+    coalesced; the one with the latest mt wins.
+    """
+    try:
+        with open(get_journal_filename(), "rb") as f:
+            lines = f.read().decode().splitlines()
+    except OSError:
+        return []
+    records = {}
+    for line in lines:
+        try:
+            r = json.loads(line)
+        except ValueError:
+            continue  # e.g. a line that was not completely written
+        key = r.get("key")
+        if key not in records or r.get("mt", 0) >= records[key].get("mt", 0):
+            records[key] = r
+    return list(records.values())
+
+
+def remove_records(records):
+    """Remove the given records from the journal. Records that were
+    appended in the meantime (with another mt) are kept.
+    """
+    done = {(r.get("key"), r.get("mt")) for r in records}
+    filename = get_journal_filename()
+    tmp_filename = f"{filename}.{os.getpid()}.tmp"
+    # Hold the lock from reading to replacing, so no append gets lost
+    with locked():
+        remaining = []
+        for r in read_records():
+            if (r.get("key"), r.get("mt")) not in done:
+                remaining.append(r)
+        with _open(tmp_filename, "wb") as f:
+            f.write("".join(json.dumps(r) + "\n" for r in remaining).encode())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_filename, filename)
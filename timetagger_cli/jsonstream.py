@@ -0,0 +1,103 @@
+"""
+Incremental parsing of JSON responses, so that the records of a large
+response can be processed as they arrive, instead of holding the whole
+response (and all records in it) in memory.
+"""
+
+import re
+import json
+import codecs
+
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r"[ \t\n\r]*")
+_number_chars = re.compile(r"[0-9.eE+-]*")
+
+
+def iter_array(chunks, name):
+    """Iterate over the items of the array with the given name, in a JSON
+    object that is given as an iterable of bytes chunks. The other values
+    in the object are skipped. Raises ValueError if the JSON is invalid.
+    """
+    reader = _Reader(chunks)
+    reader.expect("{")
+    if reader.peek() == "}":
+        return
+    while True:
+        key = reader.value()
+        reader.expect(":")
+        if key == name and reader.peek() == "[":
+            reader.expect("[")
+            if reader.peek() == "]":
+                reader.expect("]")
+            else:
+                while True:
+                    yield reader.value()
+                    if reader.expect(",]") == "]":
+                        break
+        else:
+            reader.value()
+        if reader.expect(",}") == "}":
+            return
+
+
+class _Reader:
+    """Read JSON values from a stream of bytes chunks."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._text = ""
+        self._pos = 0
+        self._eof = False
+
+    def _read(self):
+        # Append the next chunk to the text. Returns False at the end.
+        if self._eof:
+            return False
+        text = ""
+        for chunk in self._chunks:
+            text = self._decoder.decode(chunk)
+            if text:
+                break
+        else:
+            text = self._decoder.decode(b"", True)
+            self._eof = True
+        self._text = self._text[self._pos :] + text
+        self._pos = 0
+        return True
+
+    def peek(self):
+        """Get the next character that is not whitespace."""
+        while True:
+            self._pos = _whitespace.match(self._text, self._pos).end()
+            if self._pos < len(self._text):
+                return self._text[self._pos]
+            elif not self._read():
+                raise ValueError("Unexpected end of JSON data")
+
+    def expect(self, chars):
+        """Consume the next character, which must be one of the given chars."""
+        c = self.peek()
+        if c not in chars:
+            raise ValueError(f"Expected one of {chars!r} in JSON data, got {c!r}")
+        self._pos += 1
+        return c
+
+    def value(self):
+        """Consume the next JSON value and return it."""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._text, self._pos)
+            except json.JSONDecodeError:
+                if not self._read():
+                    raise
+                continue
+            # A number at the end of the text may continue in the next chunk
+            if isinstance(value, (int, float)) and not self._eof:
+                if _number_chars.match(self._text, end).end() == len(self._text):
+                    self._read()
+                    continue
+            self._pos = end
+            return value
@@ -0,0 +1,185 @@
+"""
+A compact representation of records. The API (and the local store) use
+dicts, but when many records are held in memory, Record objects take less
+than half the space, and their fields are faster to access.
+"""
+
+import time
+import heapq
+import operator
+import collections
+
+from .utils import get_tags
+from .intervals import Intervals
+
+
+class Record:
+    """A record, with the same fields as the dicts that the API uses."""
+
+    __slots__ = ("key", "t1", "t2", "mt", "st", "ds", "_tags")
+
+    def __init__(self, key, t1, t2, mt=0, st=0, ds=""):
+        self.key = key
+        self.t1 = t1
+        self.t2 = t2
+        self.mt = mt
+        self.st = st
+        self.ds = ds
+        self._tags = None
+
+    def __repr__(self):
+        return f"<Record {self.key} {self.t1}-{self.t2} {self.ds!r}>"
+
+    @classmethod
+    def from_dict(cls, d):
+        """Create a record from a dict, like the API returns."""
+        get = d.get
+        return cls(
+            get("key", ""), d["t1"], d["t2"], get("mt", 0), get("st", 0), get("ds", "")
+        )
+
+    def to_dict(self):
+        """Get the record as a dict, like the API expects."""
+        return {
+            "key": self.key,
+            "t1": self.t1,
+            "t2": self.t2,
+            "mt": self.mt,
+            "st": self.st,
+            "ds": self.ds,
+        }
+
+    @property
+    def running(self):
+        return self.t1 == self.t2
+
+    @property
+    def hidden(self):
+        return self.ds.startswith("HIDDEN")
+
+    @property
+    def tags(self):
+        """The (lowercase) tags in the description."""
+        if self._tags is None:
+            self._tags = get_tags(self.ds)
+        return self._tags
+
+    @property
+    def duration(self):
+        """The duration in seconds. Running records last until now."""
+        return (time.time() if self.t1 == self.t2 else self.t2) - self.t1
+
+
+def as_record(r):
+    """Get a Record for the given dict (or Record)."""
+    return r if isinstance(r, Record) else Record.from_dict(r)
+
+
+class RecordBatch:
+    """A list of Record objects, with methods to select records from it.
+    Can be created from any iterable of dicts or Records.
+    """
+
+    __slots__ = ("records",)
+
+    def __init__(self, records=()):
+        self.records = list(map(as_record, records))
+
+    @classmethod
+    def _from_list(cls, records):
+        batch = cls()
+        batch.records = records
+        return batch
+
+    def __repr__(self):
+        return f"<RecordBatch with {len(self.records)} records>"
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._from_list(self.records[index])
+        return self.records[index]
+
+    def to_dicts(self):
+        """Get the records as a list of dicts."""
+        return [r.to_dict() for r in self.records]
+
+    def sorted(self):
+        """Get a new batch, with the records sorted by t1."""
+        return self._from_list(sorted(self.records, key=operator.attrgetter("t1")))
+
+    def visible(self):
+        """Get a new batch without the hidden records."""
+        return self._from_list(
+            [r for r in self.records if not r.ds.startswith("HIDDEN")]
+        )
+
+    def running(self):
+        """Get a new batch with only the running records."""
+        return self._from_list([r for r in self.records if r.t1 == r.t2])
+
+    def overlapping(self, t1, t2):
+        """Get a new batch with the records that overlap with the given
+        time range. Running records overlap with everything after t1.
+        """
+        return self._from_list(
+            [r for r in self.records if r.t1 < t2 and (r.t1 == r.t2 or r.t2 > t1)]
+        )
+
+    def intervals(self, now):
+        """Get the Intervals of the records. Running records end at now."""
+        records = self.records
+        t1 = [r.t1 for r in records]
+        t2 = [now if r.t1 == r.t2 else r.t2 for r in records]
+        return Intervals(t1, t2)
+
+    def overlaps(self):
+        """Find the pairs of stopped records that overlap, with a sweep line
+        over the records sorted by t1, which takes O(n log n) plus the
+        number of pairs. Returns a list of (record1, record2) tuples, where
+        record1 starts first.
+        """
+        pairs = []
+        active = []  # heap of (t2, index, record) that the sweep line is in
+        records = sorted(self.records, key=operator.attrgetter("t1"))
+        for i, r in enumerate(records):
+            if r.t1 == r.t2:
+                continue
+            while active and active[0][0] <= r.t1:
+                heapq.heappop(active)
+            for _, _, r0 in sorted(active, key=operator.itemgetter(1)):
+                pairs.append((r0, r))
+            heapq.heappush(active, (r.t2, i, r))
+        return pairs
+
+    def duplicates(self, tolerance=0):
+        """Find groups of records that have the same description, and start
+        and end times that differ at most tolerance seconds (from the first
+        record in the group). Returns a list of lists of records, each
+        sorted by t1.
+        """
+        groups = []
+        recent = collections.defaultdict(collections.deque)  # ds -> deque
+        # Records with a unique description cannot be duplicates, skip these
+        counts = collections.Counter(r.ds.strip() for r in self.records)
+        records = [r for r in self.records if counts[r.ds.strip()] > 1]
+        for r in sorted(records, key=operator.attrgetter("t1")):
+            # The records with this description that start at most tolerance
+            # seconds earlier, together with the group they are the first of.
+            window = recent[r.ds.strip()]
+            while window and window[0][0].t1 < r.t1 - tolerance:
+                window.popleft()
+            for r0, group in window:
+                if abs(r.t2 - r0.t2) <= tolerance:
+                    group.append(r)
+                    break
+            else:
+                group = [r]
+                groups.append(group)
+                window.append((r, group))
+        return [group for group in groups if len(group) > 1]
@@ -0,0 +1,190 @@
+"""
+An optional resident process that runs commands on behalf of the CLI.
+It keeps a warm HTTP session and an in-memory copy of the records (kept
+fresh via ``updates?since=``). The CLI forwards commands to it over a
+Unix domain socket.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+from contextlib import redirect_stdout, redirect_stderr
+
+from .config import get_config_dir
+
+socket_fname = "daemon.sock"
+
+# Commands that the CLI lets the daemon run. Commands that may ask for
+# input, or that deal with files, are always run by the CLI itself.
+forwarded_commands = ["status", "show", "report", "start", "stop", "add", "sync"]
+
+# Commands after which the daemon syncs its records right away
+writing_commands = ["start", "stop", "add", "sync"]
+
+
+def get_socket_path():
+    return os.path.join(get_config_dir(), socket_fname)
+
+
+def forward(argv, path=None):
+    """Let the daemon run the command with the given arguments. Returns
+    a dict with the output, error output and exit code, or None if no
+    daemon is running.
+    """
+    import socket
+
+    path = path or get_socket_path()
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(path):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(1)
+        try:
+            sock.connect(path)
+        except OSError:
+            return None  # a stale socket file, run the command ourselves
+        # Once the command is sent, it may have been run, so no fallback
+        try:
+            sock.settimeout(None)
+            sock.sendall(json.dumps({"argv": argv}).encode() + b"\n")
+            return json.loads(_recv_all(sock).decode())
+        except (OSError, ValueError) as err:
+            raise RuntimeError(f"Lost the connection with the daemon: {err}")
+    finally:
+        sock.close()
+
+
+def _recv_all(sock):
+    chunks = []
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            return b"".join(chunks)
+        chunks.append(chunk)
+
+
+def run_forwarded_command(argv):
+    """Run a command like the CLI would, and return its output and exit
+    code, and the name of the command. Only the forwarded commands are run.
+    """
+    from .__main__ import setup_parser, run_command
+
+    out, err_out = io.StringIO(), io.StringIO()
+    command = None
+    with redirect_stdout(out), redirect_stderr(err_out):
+        try:
+            args = setup_parser().parse_args(argv)
+            if hasattr(args, "func"):
+                command = args.func.__name__
+            if command not in forwarded_commands:
+                raise RuntimeError(f"The daemon does not run {command!r} commands.")
+            run_command(args)
+            code = 0
+        except RuntimeError as err:
+            msg = err.args[0] if err.args else "''"
+            code = f"Timetagger runtime error: {msg}"
+        except SystemExit as err:
+            code = err.code
+        except Exception as err:
+            code = f"Timetagger daemon error: {err!r}"
+    result = {"output": out.getvalue(), "error": err_out.getvalue(), "exit": code}
+    return result, command
+
+
+class Daemon:
+    """Serves commands forwarded by the CLI, one at a time."""
+
+    # How often (in seconds) to check whether to stop or to sync
+    poll_interval = 1
+
+    def __init__(self, path=None, sync_interval=10):
+        self.path = path or get_socket_path()
+        self.sync_interval = sync_interval
+        self.running = False
+        self._last_sync = 0
+
+    def serve(self):
+        """Serve until stop() is called, or the process is interrupted."""
+        import socket
+        from . import core
+        from .store import RecordStore
+
+        if not hasattr(socket, "AF_UNIX"):
+            raise RuntimeError("The daemon needs Unix sockets, not available here.")
+        if forward(["--version"], self.path) is not None:
+            raise RuntimeError(f"A daemon is already running at {self.path}")
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o177)  # only this user can connect
+        try:
+            sock.bind(self.path)
+        finally:
+            os.umask(umask)
+        sock.listen(16)
+        sock.settimeout(self.poll_interval)
+
+        # Keep the records in memory, or use the local store if enabled
+        core._store = core.get_store() or RecordStore(":memory:")
+        self.running = True
+        try:
+            self.sync()
+            while self.running:
+                try:
+                    conn, _ = sock.accept()
+                except socket.timeout:
+                    if time.time() - self._last_sync > self.sync_interval:
+                        self.sync()
+                    continue
+                with conn:
+                    self.handle(conn)
+        finally:
+            self.running = False
+            sock.close()
+            os.remove(self.path)
+            core._store.close()
+            core._store = None
+
+    def stop(self):
+        """Stop serving (after the current command)."""
+        self.running = False
+
+    def sync(self):
+        """Pull the changed records from the server."""
+        from . import core
+
+        # The deadline for requests is per command, and this is a new sync
+        core._deadline = None
+        try:
+            core._store.sync(core.request)
+        except RuntimeError as err:
+            print(f"Could not sync: {err}", file=sys.stderr)
+        self._last_sync = time.time()
+
+    def handle(self, conn):
+        """Handle a single forwarded command."""
+        from . import core
+
+        conn.settimeout(5)
+        try:
+            request = json.loads(conn.makefile("rb").readline().decode())
+            argv = request["argv"]
+        except (OSError, ValueError, KeyError) as err:
+            print(f"Invalid request: {err}", file=sys.stderr)
+            return
+        if time.time() - self._last_sync > self.sync_interval:
+            self.sync()
+        core._flush_failed = False
+        core._deadline = None
+        result, command = run_forwarded_command(argv)
+        try:
+            conn.sendall(json.dumps(result).encode())
+        except OSError as err:
+            print(f"Could not send result: {err}", file=sys.stderr)
+        if command in writing_commands:
+            conn.close()
+            self.sync()
@@ -0,0 +1,94 @@
+"""
+A small cache of the records of recently requested time ranges, so that
+commands that are run often (e.g. 'status' in a status bar) don't download
+the same records each time. The cache is validated via the incremental
+``updates?since=`` endpoint, which only returns the records that changed.
+"""
+
+import os
+import time
+
+from .config import get_config_dir
+from .utils import read_state, write_private
+
+
+cache_fname = "response_cache.json"
+
+# The max number of time ranges to keep records for
+max_entries = 8
+
+
+def get_cache_filename():
+    return os.path.join(get_config_dir(), cache_fname)
+
+
+def overlaps(r, t1, t2):
+    """Get whether the record overlaps with the time range, like the server does."""
+    return (r["t2"] >= t1 and r["t1"] <= t2) or (r["t1"] == r["t2"] and r["t1"] <= t2)
+
+
+def get_records(request, t1, t2, ttl):
+    """Get the records that overlap with the given time range. The records
+    come from the cache if it holds a range that contains this range. The
+    cache is validated with the server if it was last validated more than
+    ttl seconds ago.
+    """
+    cache = _load()
+    entry = _find_entry(cache, t1, t2)
+    if entry is not None and time.time() - cache["checked"] > ttl:
+        _validate(request, cache)
+        entry = _find_entry(cache, t1, t2)  # None if the server reset
+        _save(cache)
+    if entry is None:
+        # Changes after the server time of the last validation are applied
+        # on the next validation, so a server time is needed before fetching.
+        if not cache["server_time"]:
+            _validate(request, cache)
+        ob = request("GET", f"records?timerange={t1}-{t2}")
+        entry = {"t1": t1, "t2": t2, "records": ob["records"]}
+        cache["entries"] = [entry] + cache["entries"][: max_entries - 1]
+        _save(cache)
+    return [r for r in entry["records"] if overlaps(r, t1, t2)]
+
+
+def _find_entry(cache, t1, t2):
+    for entry in cache["entries"]:
+        if entry["t1"] <= t1 and t2 <= entry["t2"]:
+            return entry
+    return None
+
+
+def _validate(request, cache):
+    # Apply the changes since the last validation. The first time, this is
+    # mainly to get the server time.
+    since = cache["server_time"] or time.time()
+    ob = request("GET", f"updates?since={since}")
+    if ob.get("reset"):
+        cache["entries"] = []
+    changed = {r["key"]: r for r in ob["records"]}
+    for entry in cache["entries"]:
+        t1, t2 = entry["t1"], entry["t2"]
+        records = [r for r in entry["records"] if r["key"] not in changed]
+        records += [r for r in changed.values() if overlaps(r, t1, t2)]
+        entry["records"] = records
+    cache["server_time"] = ob["server_time"]
+    cache["checked"] = time.time()
+
+
+def invalidate():
+    """Let the cache be validated before it is used again, e.g. because
+    records were pushed to the server.
+    """
+    if os.path.isfile(get_cache_filename()):
+        cache = _load()
+        cache["checked"] = 0
+        _save(cache)
+
+
+def _load():
+    default = {"version": 1, "server_time": 0, "checked": 0, "entries": []}
+    return read_state(get_cache_filename(), default)
+
+
+def _save(cache):
+    write_private(get_cache_filename(), cache)
@@ -0,0 +1,75 @@
+"""
+The running records (timers), tracked locally, so that 'start' and 'stop'
+don't need to ask the server. The local state is updated with the records
+that this client pushes, and reconciled with the changes made by other
+clients via the incremental ``updates?since=`` endpoint once it's stale.
+"""
+
+import os
+import time
+
+from .config import get_config_dir
+from .utils import read_state, write_private
+
+
+state_fname = "running.json"
+
+
+def get_state_filename():
+    return os.path.join(get_config_dir(), state_fname)
+
+
+def get_running_records(request, ttl):
+    """Get the running records. The server is asked for changes if the
+    local state was last checked more than ttl seconds ago.
+    """
+    state = _load()
+    now = time.time()
+    if not state["server_time"]:
+        # Get the server time first, so no change is missed
+        ob = request("GET", f"updates?since={now}")
+        since = ob["server_time"]
+        window = f"{int(now - 35 * 60)}-{int(now + 60)}"
+        ob = request("GET", f"records?timerange={window}")
+        state["records"] = {}
+        _apply(state, ob["records"])
+        state["server_time"] = since
+        state["checked"] = now
+        _save(state)
+    elif now - state["checked"] > ttl:
+        ob = request("GET", f"updates?since={state['server_time']}")
+        if ob.get("reset"):
+            state["server_time"] = 0
+            _save(state)
+            return get_running_records(request, ttl)
+        _apply(state, ob["records"])
+        state["server_time"] = ob["server_time"]
+        state["checked"] = now
+        _save(state)
+    return list(state["records"].values())
+
+
+def update(records):
+    """Update the local state with records that this client pushes."""
+    state = _load()
+    if state["server_time"]:
+        _apply(state, records)
+        _save(state)
+
+
+def _apply(state, records):
+    running = state["records"]
+    for r in records:
+        if r["t1"] == r["t2"]:
+            running[r["key"]] = r
+        else:
+            running.pop(r["key"], None)
+
+
+def _load():
+    default = {"version": 1, "server_time": 0, "checked": 0, "records": {}}
+    return read_state(get_state_filename(), default)
+
+
+def _save(state):
+    write_private(get_state_filename(), state)
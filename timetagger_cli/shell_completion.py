@@ -0,0 +1,183 @@
+"""
+Shell completion for tags and descriptions. Completions are answered from
+a small index file (ranked by frequency and recency), so that the
+completion path needs no network and no slow imports. The index is
+refreshed in a background process, from the local store if it's enabled,
+or otherwise from the records of the last year.
+"""
+
+import os
+import json
+import time
+
+from . import commands
+from .config import get_config_dir
+
+
+index_fname = "completion_index.json"
+
+# The names of the subcommands (the function for 'import' has another name)
+command_names = ["import" if c == "import_records" else c for c in commands]
+
+# The index is refreshed in the background when it's older than this (seconds)
+refresh_interval = 600
+
+# The weight of a record halves with each this many days of age
+half_life_days = 30
+
+# Without a local store, only the records of this many days are indexed
+index_days = 365
+
+max_candidates = 50
+
+options_with_value = ["--profile", "--date"]
+
+scripts = {
+    "bash": """
+_timetagger_complete() {
+    local IFS=$'\\n' candidate
+    COMPREPLY=()
+    for candidate in $(timetagger __complete "${COMP_WORDS[@]:0:COMP_CWORD+1}"); do
+        COMPREPLY+=("$(printf '%q' "${candidate%%$'\\t'*}")")
+    done
+}
+complete -o nosort -F _timetagger_complete timetagger
+""",
+    "zsh": """
+_timetagger_complete() {
+    local -a candidates
+    candidates=("${(@f)$(timetagger __complete "${(@)words[1,CURRENT]}")}")
+    candidates=(${candidates:#})
+    compadd -V timetagger -- "${candidates[@]%%$'\\t'*}"
+}
+compdef _timetagger_complete timetagger
+""",
+    "fish": """
+function __timetagger_complete
+    set -l cur (commandline -ct)
+    timetagger __complete (commandline -opc) "$cur"
+end
+complete -c timetagger -f -k -a '(__timetagger_complete)'
+""",
+}
+
+
+def get_index_filename():
+    return os.path.join(get_config_dir(), index_fname)
+
+
+def get_completions(words, index):
+    """Get the completion candidates for the given command-line words (the
+    last one being the word to complete), using the given index.
+    """
+    words = words[1:]  # drop the program name
+    cur = words[-1].lstrip("'\"") if words else ""
+    previous = []  # the command and its positional arguments
+    for i, word in enumerate(words[:-1]):
+        if word.startswith("-"):
+            continue
+        elif i > 0 and words[i - 1] in options_with_value:
+            continue
+        previous.append(word)
+
+    if not previous:
+        options = ["--help", "--version", "--timings", "--profile"]
+        return [c for c in command_names + options if c.startswith(cur)]
+
+    command, positional = previous[0], previous[1:]
+    if command == "resume" and not positional:
+        recent = index.get("recent", [])
+        return [f"{i + 1}\t{ds}" for i, ds in enumerate(recent)]
+    elif command == "start" and not positional:
+        return _complete_description(cur, index)
+    elif command == "add" and len(positional) == 2:
+        return _complete_description(cur, index)
+    return []
+
+
+def _complete_description(cur, index):
+    # Complete the tag that is being typed
+    head, _, last = cur.rpartition(" ")
+    if last.startswith("#"):
+        head = head + " " if head else ""
+        tags = [t for t in index.get("tags", []) if t.startswith(last.lower())]
+        return [head + t for t in tags[:max_candidates]]
+    # Otherwise complete the whole description
+    cur_lower = cur.lower()
+    descriptions = index.get("descriptions", [])
+    candidates = [ds for ds in descriptions if ds.lower().startswith(cur_lower)]
+    return candidates[:max_candidates]
+
+
+def complete(words):
+    """Print the completion candidates, one per line. Starts a refresh of
+    the index in the background if it's out of date.
+    """
+    filename = get_index_filename()
+    try:
+        if time.time() - os.path.getmtime(filename) > refresh_interval:
+            _start_refresh(filename)
+        with open(filename, "rb") as f:
+            index = json.loads(f.read().decode())
+    except OSError:
+        _start_refresh(filename)
+        index = {}
+    except ValueError:
+        index = {}  # e.g. being refreshed for the first time
+    candidates = get_completions(words, index)
+    if candidates:
+        print("\n".join(candidates))
+
+
+def _start_refresh(filename):
+    import sys
+    from .utils import run_detached
+
+    # Touch the index, so that other completions don't start a refresh too
+    try:
+        os.close(os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600))
+        os.utime(filename)
+    except OSError:
+        return
+    run_detached([sys.executable, "-m", "timetagger_cli", "completion", "--refresh"])
+
+
+def refresh_index(records):
+    """Build the index of tags and descriptions from the given records,
+    and write it to the index file. Returns the index.
+    """
+    from .utils import get_tags, write_private
+
+    records = [r for r in records if not r["ds"].startswith("HIDDEN")]
+    index = build_index(records, get_tags)
+    write_private(get_index_filename(), index)
+    return index
+
+
+def build_index(records, get_tags, now=None):
+    """Rank tags and descriptions by frequency and recency, and list the
+    records that 'resume' would offer.
+    """
+    from .utils import get_resume_range, select_resume_records
+
+    now = time.time() if now is None else now
+    tag_scores = {}
+    ds_scores = {}
+    for r in records:
+        weight = 0.5 ** (max(0, now - r["t1"]) / (86400 * half_life_days))
+        ds = r["ds"].strip()
+        if ds:
+            ds_scores[ds] = ds_scores.get(ds, 0) + weight
+        for tag in get_tags(ds):
+            tag_scores[tag] = tag_scores.get(tag, 0) + weight
+
+    # The records that 'resume' offers, numbered from the most recent one
+    t1, t2 = get_resume_range(now)
+    recent = select_resume_records(
+        [r for r in records if r["t1"] < t2 and (r["t1"] == r["t2"] or r["t2"] > t1)]
+    )
+    return {
+        "tags": sorted(tag_scores, key=tag_scores.get, reverse=True)[:500],
+        "descriptions": sorted(ds_scores, key=ds_scores.get, reverse=True)[:1000],
+        "recent": [r["ds"] for r in reversed(recent)],
+    }
@@ -0,0 +1,136 @@
+"""
+A local on-disk copy of the user's records, kept in sync with the server
+via the incremental ``updates?since=`` endpoint.
+"""
+
+import os
+import sqlite3
+
+from .utils import get_tags
+from .config import get_config_dir
+
+
+store_fname = "records.sqlite"
+
+
+class RecordStore:
+    """A SQLite database that mirrors the records on the server.
+
+    The server time of the last sync is remembered, so that each sync
+    only needs to download the records that changed since then.
+    """
+
+    def __init__(self, filename=None):
+        if filename is None:
+            filename = os.path.join(get_config_dir(), store_fname)
+        self.filename = filename
+        if filename != ":memory:" and not os.path.exists(filename):
+            # The store contains the user's records, so only the user may read it
+            os.close(os.open(filename, os.O_WRONLY | os.O_CREAT, 0o600))
+        self._db = sqlite3.connect(filename)
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS records (
+                key TEXT PRIMARY KEY,
+                t1 NUMERIC, t2 NUMERIC, mt NUMERIC, st NUMERIC, ds TEXT, tags TEXT
+            );
+            CREATE INDEX IF NOT EXISTS records_t1 ON records (t1);
+            CREATE INDEX IF NOT EXISTS records_t2 ON records (t2);
+            CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value);
+            """
+        )
+        # Stores created by older versions have no tags column
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(records)")]
+        if "tags" not in columns:
+            with self._db:
+                self._db.execute("ALTER TABLE records ADD COLUMN tags TEXT")
+                self._db.executemany(
+                    "UPDATE records SET tags = ? WHERE key = ?",
+                    [
+                        (" ".join(get_tags(ds)), key)
+                        for key, ds in self._db.execute("SELECT key, ds FROM records")
+                    ],
+                )
+
+    def close(self):
+        self._db.close()
+
+    @property
+    def server_time(self):
+        """The server time of the last sync (0 if never synced)."""
+        row = self._db.execute(
+            "SELECT value FROM meta WHERE name = 'server_time'"
+        ).fetchone()
+        return row[0] if row else 0
+
+    def sync(self, request):
+        """Pull the records that changed since the last sync from the server.
+        The given request function is used to do the API call. Returns the
+        number of updated records.
+        """
+        ob = request("GET", f"updates?since={self.server_time}")
+        with self._db:
+            if ob.get("reset"):
+                self._db.execute("DELETE FROM records")
+            self._put_records(ob["records"])
+            self._db.execute(
+                "INSERT OR REPLACE INTO meta (name, value) VALUES ('server_time', ?)",
+                (ob["server_time"],),
+            )
+        return len(ob["records"])
+
+    def put_records(self, records):
+        """Insert or update the given records in the store."""
+        with self._db:
+            self._put_records(records)
+
+    def _put_records(self, records):
+        # The tags are extracted once, and stored alongside the record
+        rows = []
+        for r in records:
+            row = {"mt": 0, "st": 0, "ds": "", **r}
+            row["tags"] = " ".join(get_tags(row["ds"]))
+            rows.append(row)
+        self._db.executemany(
+            "INSERT OR REPLACE INTO records (key, t1, t2, mt, st, ds, tags) "
+            "VALUES (:key, :t1, :t2, :mt, :st, :ds, :tags)",
+            rows,
+        )
+
+    def get_records(self, t1, t2):
+        """Get the records that overlap with the given time range. Like the
+        server, running records that started before the range are included.
+        """
+        return self._select(
+            "WHERE (t2 >= ? AND t1 <= ?) OR (t1 = t2 AND t1 <= ?)", (t1, t2, t2)
+        )
+
+    def get_tagged_intervals(self, t1, t2):
+        """Get (t1, t2, tags) tuples for the non-hidden records that overlap
+        with the given time range, using the tags that were extracted
+        when the records were stored.
+        """
+        cursor = self._db.execute(
+            "SELECT t1, t2, tags FROM records "
+            "WHERE ((t2 >= ? AND t1 <= ?) OR (t1 = t2 AND t1 <= ?)) "
+            "AND ds NOT LIKE 'HIDDEN%' ORDER BY t1",
+            (t1, t2, t2),
+        )
+        return [(t1, t2, tuple(tags.split())) for t1, t2, tags in cursor]
+
+    def get_all_records(self):
+        """Get all records in the store."""
+        return self._select("", ())
+
+    def get_running_records(self):
+        """Get the records that are currently running."""
+        return self._select("WHERE t1 = t2", ())
+
+    def _select(self, where, params):
+        cursor = self._db.execute(
+            f"SELECT key, t1, t2, mt, st, ds FROM records {where} ORDER BY t1", params
+        )
+        return [
+            {"key": key, "t1": t1, "t2": t2, "mt": mt, "st": st, "ds": ds}
+            for key, t1, t2, mt, st, ds in cursor
+        ]
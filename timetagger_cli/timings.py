@@ -0,0 +1,66 @@
+"""
+Instrumentation for the --timings flag, to show where the time of a
+command goes. When not enabled, the only cost is checking a boolean.
+"""
+
+import sys
+import time
+
+
+t_start = time.perf_counter()
+
+enabled = False
+_phases = []
+
+
+def enable():
+    global enabled
+    enabled = True
+    _phases.clear()
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def add(phase, duration, info=""):
+    """Add the duration of a phase (call only when enabled)."""
+    _phases.append((phase, duration, info))
+
+
+def timed(phase, func):
+    """Wrap a function so that its calls are added as the given phase."""
+
+    def wrapper(*args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            add(phase, time.perf_counter() - t0)
+
+    return wrapper
+
+
+def report(command_duration, file=None):
+    """Print the phases to stderr. Phases that occurred multiple times are
+    summed (except requests). The time of the command that is not spent
+    in any of the phases is shown as render.
+    """
+    file = file or sys.stderr
+    phases = {}
+    for phase, duration, info in _phases:
+        key = (phase, info) if info else phase
+        prev = phases.get(key, (phase, 0.0, info, 0))
+        phases[key] = phase, prev[1] + duration, info, prev[3] + 1
+    accounted = sum(x[1] for x in phases.values() if x[0] != "startup")
+    startup = sum(x[1] for x in phases.values() if x[0] == "startup")
+    render = max(0.0, command_duration - accounted)
+    lines = list(phases.values())
+    lines.append(("render", render, "", 1))
+    lines.append(("total", startup + command_duration, "", 1))
+    print("Timings:", file=file)
+    for phase, duration, info, count in lines:
+        if count > 1 and not info:
+            info = f"{count} calls"
+        print(f"  {phase:<10} {duration*1000:>9.1f} ms  {info}".rstrip(), file=file)
@@ -1,8 +1,11 @@
 import os
+import re
 import sys
-import secrets
+import json
 import datetime
-import subprocess
+import functools
+
+from .intervals import Intervals
 
 
 def generate_uid():
@@ -11,6 +14,8 @@ def generate_uid():
     who has been creating 100 records a day, for 20 years (about 1M records),
     the chance of a collision for a new record is about 1 in 50 milion.
     """
+    import secrets
+
     n = 8
     chars = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
     # with len(chars) 52 => 52**8 => 53459728531456 possibilities
@@ -19,6 +24,8 @@ def generate_uid():
 
 def open_with_os_default(path):
     """Open the given filename with the OS default application."""
+    import subprocess
+
     if sys.platform.startswith("darwin"):
         subprocess.call(("open", path))
     elif sys.platform.startswith("win"):
@@ -37,6 +44,20 @@ def open_with_os_default(path):
         raise RuntimeError(f"Don't know how to open {path}")
 
 
+def run_detached(args):
+    """Run a command in the background, independent of this process."""
+    import subprocess
+
+    kwargs = dict(
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    if sys.platform.startswith("win"):
+        kwargs["creationflags"] = subprocess.DETACHED_PROCESS
+    else:
+        kwargs["start_new_session"] = True
+    subprocess.Popen(args, **kwargs)
+
+
 def user_config_dir(appname=None, roaming=False):
     """Get the directory to store app config files."""
     if sys.platform.startswith("win"):
@@ -56,16 +77,167 @@ def user_config_dir(appname=None, roaming=False):
     return path
 
 
-def total_time(records, start, end):
-    total = 0
-    t_start = start.timestamp()
-    t_end = end.timestamp()
+def read_state(filename, default):
+    """Read a JSON file written with write_private(), e.g. a cache. Returns
+    default if there is no (valid) file, or if its version differs from
+    that of the default.
+    """
+    try:
+        with open(filename, "rb") as f:
+            state = json.loads(f.read().decode())
+        if state.get("version") == default.get("version"):
+            return state
+    except (OSError, ValueError, AttributeError):
+        pass
+    return default
+
+
+def write_private(filename, state):
+    """Write the state to a JSON file. Local state can contain the user's
+    records or token, so the file is only accessible to the user. It is
+    written atomically, so it's never read half-written.
+    """
+    tmp_filename = f"{filename}.{os.getpid()}.tmp"
+    fd = os.open(tmp_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(json.dumps(state).encode())
+    os.replace(tmp_filename, filename)
+
+
+@functools.lru_cache(maxsize=4096)
+def get_tags(ds):
+    """Get the (lowercase) tags in the given description, in order of
+    appearance, without duplicates.
+    """
+    tags = re.findall(r"#[^\s#.,!?:;()\[\]{}<>'\"]+", ds.lower())
+    return tuple(dict.fromkeys(tags))
+
+
+def get_resume_range(now):
+    """Get the time range (t1, t2) of the records that can be resumed:
+    from the start of the day a week ago, until the end of today.
+    """
+    d = datetime.datetime.fromtimestamp(now)
+    today = datetime.datetime(d.year, d.month, d.day)
+    last_week = today - datetime.timedelta(days=7)
+    tomorrow = today + datetime.timedelta(days=1)
+    return int(last_week.timestamp()), int(tomorrow.timestamp())
+
+
+def select_resume_records(records):
+    """Select the (at most 10) records that can be resumed, from the records
+    in the resume range. Hidden records are skipped. The records are sorted
+    by t2, so the last one is number 1.
+    """
+    records = [r for r in records if "HIDDEN" not in r["ds"]]
+    records.sort(key=lambda r: r["t2"])
+    return records[-10:]
+
+
+def total_time(records, start, end, merge_overlaps=False):
+    """Get the total duration of the records (a list of dicts, or a
+    RecordBatch), clipped to the given range.
+    With merge_overlaps, time covered by multiple records counts once.
+    """
     t_now = datetime.datetime.now().timestamp()
-    for r in records:
-        t1 = r["t1"]
-        t2 = r["t2"] if r["t1"] != r["t2"] else t_now
-        total += min(t_end, t2) - max(t_start, t1)
-    return total
+    if hasattr(records, "intervals"):
+        intervals = records.intervals(t_now)  # a RecordBatch
+    else:
+        intervals = Intervals.from_records(records, t_now)
+    if merge_overlaps:
+        intervals = intervals.union()
+    return intervals.total(start.timestamp(), end.timestamp())
+
+
+weekdays = [
+    "monday",
+    "tuesday",
+    "wednesday",
+    "thursday",
+    "friday",
+    "saturday",
+    "sunday",
+]
+
+
+def parse_date(string, today=None):
+    """Parse the common ways to write a date: ISO format (YYYY-MM-DD),
+    'today', 'yesterday', 'tomorrow', weekday names (meaning the most
+    recent such day), and offsets like '-3d' or '+1w'. Returns None if
+    the string is not recognized. Raises ValueError if the resulting date
+    is out of range.
+    """
+    s = string.strip().lower()
+    today = today or datetime.date.today()
+    if s in ("today", "now"):
+        return today
+    elif s == "yesterday":
+        return today - datetime.timedelta(days=1)
+    elif s == "tomorrow":
+        return today + datetime.timedelta(days=1)
+    for i, name in enumerate(weekdays):
+        if len(s) >= 3 and name.startswith(s):
+            return today - datetime.timedelta(days=(today.weekday() - i) % 7)
+    m = re.fullmatch(r"([+-])(\d+)([dw])", s)
+    if m:
+        days = int(m.group(2)) * (7 if m.group(3) == "w" else 1)
+        try:
+            return today + datetime.timedelta(days=days if m.group(1) == "+" else -days)
+        except OverflowError:
+            raise ValueError(f"Date offset {string!r} is out of range") from None
+    try:
+        return datetime.date.fromisoformat(s)
+    except ValueError:
+        return None
+
+
+def parse_time(string):
+    """Parse the common ways to write a time: 'hh:mm', 'hhmm', 'hh:mm:ss',
+    and 'now'. Returns None if the string is not recognized.
+    """
+    s = string.strip().lower()
+    if s == "now":
+        return datetime.datetime.now().time().replace(microsecond=0)
+    m = re.fullmatch(r"(\d{1,2}):?(\d\d)(?::(\d\d))?", s)
+    if m:
+        try:
+            return datetime.time(int(m.group(1)), int(m.group(2)), int(m.group(3) or 0))
+        except ValueError:
+            return None
+    return None
+
+
+def get_period_edges(start, end, period):
+    """Get the datetimes that split the range from start to end in
+    periods of a "day", "week" (starting on Monday), or "month". The
+    first and last edge are start and end.
+    """
+    edges = [start]
+    d = datetime.datetime(start.year, start.month, start.day)
+    while True:
+        if period == "day":
+            d += datetime.timedelta(days=1)
+        elif period == "week":
+            d += datetime.timedelta(days=7 - d.weekday())
+        elif period == "month":
+            d = datetime.datetime(d.year + d.month // 12, d.month % 12 + 1, 1)
+        else:
+            raise ValueError(f"Invalid period {period!r}")
+        if d >= end:
+            break
+        edges.append(d)
+    edges.append(end)
+    return edges
+
+
+def readable_period(dt, period):
+    """Turn the start of a period into a readable string."""
+    if period == "week":
+        return f"{dt:%G-W%V}"
+    elif period == "month":
+        return f"{dt:%Y-%m}"
+    else:
+        return f"{dt:%Y-%m-%d}"
 
 
 def readable_time(timestamp):
@@ -74,6 +246,32 @@ def readable_time(timestamp):
     return f"{value:%Y-%m-%d %H:%M}"
 
 
+class ReadableTimeFormatter:
+    """Turns timestamps into readable date and time strings, like
+    readable_time(), but faster for sorted timestamps, because the
+    boundaries and date string of the current day are cached.
+    """
+
+    def __init__(self):
+        self._day = 0, 0, ""
+        self._times = [f"{m // 60:02}:{m % 60:02}" for m in range(1440)]
+
+    def __call__(self, timestamp):
+        """Get the (date, time) strings for the given timestamp."""
+        day_t1, day_t2, date = self._day
+        if not day_t1 <= timestamp < day_t2:
+            value = datetime.datetime.fromtimestamp(timestamp)
+            midnight = datetime.datetime(value.year, value.month, value.day)
+            day_t1 = midnight.timestamp()
+            day_t2 = (midnight + datetime.timedelta(days=1)).timestamp()
+            if day_t2 - day_t1 != 86400 or not day_t1 <= timestamp < day_t2:
+                # DST transitions make the arithmetic below invalid
+                return f"{value:%Y-%m-%d}", f"{value:%H:%M}"
+            date = f"{value:%Y-%m-%d}"
+            self._day = day_t1, day_t2, date
+        return date, self._times[int(timestamp - day_t1) // 60]
+
+
 def readable_duration(nsecs):
     """Turn a duration in seconds into a reabable string."""
     m = round(nsecs / 60)